@@ -1,68 +1,39 @@
 # Client.py
 from tkinter import *
 import tkinter.messagebox
-import socket, threading, io, time
 
-from RtpPacket import RtpPacket
-from hd_handler import HDHandler
-from cache_manager import CacheManager
 from renderer import Renderer
+from decode_pipeline import DecodePipeline
+from stream_session import StreamSession
 
 TARGET_WIDTH = 640
 TARGET_HEIGHT = 360
+DECODE_WORKERS = 2
+DECODE_AHEAD = 4  # frames decoded ahead of the playhead
 
 
 class Client:
-    # RTSP states
-    INIT = 0
-    READY = 1
-    PLAYING = 2
-
-    # RTSP commands
-    SETUP = "SETUP"
-    PLAY = "PLAY"
-    PAUSE = "PAUSE"
-    TEARDOWN = "TEARDOWN"
+    """Tk view over a StreamSession: buttons, video canvas and progress bar.
+    Decoding and drawing happen here; the session does the streaming."""
 
     def __init__(self, master, serveraddr, serverport, rtpport, filename):
         self.master = master
         self.master.protocol("WM_DELETE_WINDOW", self.handler)
 
-        # network info
-        self.serverAddr = serveraddr
-        self.serverPort = int(serverport)
-        self.rtpPort = int(rtpport)
-        self.rtpPort2 = self.rtpPort + 2
-        self.fileName = filename
-
-        # RTSP parameters
-        self.rtspSeq = 0
-        self.sessionId = 0
-        self.state = self.INIT
-        self.requestSent = -1
-        
-        self.isPaused = False
-        self.maxCacheSize = 2000  # frames (increased for buffering)
-
-        # playback state
+        self.session = StreamSession(serveraddr, serverport, rtpport, filename,
+                                     onWarning=tkinter.messagebox.showwarning)
         self.frameNbr = 0
-        self.totalFrames = 0
- 
-        self.latestReceivedFrame = 0
-        self.bufferWarmed = False
         self.playerRunning = False
 
-        # modules
-        self.hdMode = False
-        self.hd = HDHandler()
-        self.cache = CacheManager(max_size=self.maxCacheSize)        
-        # GUI        
         # GUI
         self.createWidgets()
 
         # Renderer module
         self.renderer = Renderer(self.canvas, TARGET_WIDTH, TARGET_HEIGHT)
         self.canvas.bind("<Configure>", self.renderer.on_resize)
+        self.decoder = DecodePipeline(self.session.cache, self.renderer, workers=DECODE_WORKERS,
+                                      lookahead=DECODE_AHEAD, scheduler=self.session.playout)
+        self.readyFrame = None  # decoded frame waiting for its deadline
 
         # RTSP TCP socket
         self.connectToServer()
@@ -103,291 +74,127 @@ class Client:
         self.progressCanvas = Canvas(self.progressFrame, height=self.progressHeight,
                                      bg="#1a1a1a", highlightthickness=0)
         self.progressCanvas.place(relx=0, rely=0, relwidth=1, relheight=1)
+        self.progressCanvas.bind("<Button-1>", self.onProgressClick)  # click to seek
 
         self.cacheBarId = self.progressCanvas.create_rectangle(0, 0, 0, self.progressHeight,
                                                                fill="#e74c3c", width=0)
         self.liveBarId = self.progressCanvas.create_rectangle(0, 0, 0, self.progressHeight,
                                                               fill="#00ff00", width=0)
+        self.bufferTextId = self.progressCanvas.create_text(4, self.progressHeight // 2, anchor="w",
+                                                            fill="white", font=("TkDefaultFont", 8))
 
     # ============================================================
     # BUTTON HANDLERS
     # ============================================================
-    def get_state_text(self):
-        if self.state == self.INIT:
-            return "INIT"
-        if self.state == self.READY:
-            return "READY"
-        if self.state == self.PLAYING:
-            return "PLAYING"
-        return "UNKNOWN"
 
     def toggleHD(self):
-        self.hdMode = not self.hdMode
-        self.hdButton["text"] = "HD Mode: ON" if self.hdMode else "HD Mode: OFF"
-        print("[Client] HD Mode =", self.hdMode)
+        self.session.hdMode = not self.session.hdMode
+        self.hdButton["text"] = "HD Mode: ON" if self.session.hdMode else "HD Mode: OFF"
+        print("[Client] HD Mode =", self.session.hdMode)
 
     def setupMovie(self):
-        print(f"[STATE] Setup button pressed. State = {self.get_state_text()}")
-
-        if self.state == self.INIT:
-            self.sendRtspRequest(self.SETUP)
+        print(f"[STATE] Setup button pressed. State = {self.session.get_state_text()}")
+        self.session.setup()
 
     def playMovie(self):
-        print(f"[STATE] Play button pressed. State = {self.get_state_text()}")
-
-        if self.isPaused:
-            self.isPaused = False
-
-        if self.state == self.READY:
-            self.playEvent = threading.Event()
-            self.isPaused = False
-            # start RTP listeners
-
-            if not hasattr(self, "rtpThreads"):
-                self.rtpThreads = []
-                for sock in self.rtpSockets:
-                    t = threading.Thread(target=self.listenRtp, args=(sock,))
-                    t.daemon = True
-                    t.start()
-                    self.rtpThreads.append(t)
-
-            self.sendRtspRequest(self.PLAY)
-            if not self.playerRunning:
-                self.startPlayerLoop()
+        print(f"[STATE] Play button pressed. State = {self.session.get_state_text()}")
+        if self.session.play() and not self.playerRunning:
+            self.startPlayerLoop()
 
     def pauseMovie(self):
-        print(f"[STATE] Pause button pressed. State = {self.get_state_text()}")
-        # Only pause locally, let RTP threads continue buffering until limit
-        self.isPaused = True
+        print(f"[STATE] Pause button pressed. State = {self.session.get_state_text()}")
+        self.session.pause()
 
     def exitClient(self):
-        print(f"[STATE] Teardown button pressed. State = {self.get_state_text()}")
-        if self.state != self.INIT:
-            self.sendRtspRequest(self.TEARDOWN)
-        if hasattr(self, "playEvent"):
-            self.playEvent.set()
-        
+        print(f"[STATE] Teardown button pressed. State = {self.session.get_state_text()}")
+        self.session.teardown()
+        self.decoder.stop()
+
         self.playerRunning = False
         self.master.destroy()
-        self.rtspSocket.close()
 
     def handler(self):
         self.exitClient()
 
+    def onProgressClick(self, event):
+        width = self.progressCanvas.winfo_width()
+        if width <= 0 or self.session.totalFrames <= 0:
+            return
+        self.seekTo(int(event.x / width * self.session.totalFrames) + 1)
+
+    def seekTo(self, frameNum):
+        """Drop decoded frames and jump; the session flushes its buffer and
+        restarts the server from frameNum on the same RTSP session."""
+        print(f"[SEEK] -> frame {frameNum}")
+        self.decoder.reset()
+        self.readyFrame = None
+        if self.session.seek(frameNum):
+            self.frameNbr = self.session.frameNbr
+            if not self.playerRunning:
+                self.startPlayerLoop()
+
     # ============================================================
     # RTSP CONNECTION
     # ============================================================
 
     def connectToServer(self):
-        self.rtspSocket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         try:
-            self.rtspSocket.connect((self.serverAddr, self.serverPort))
-        except:
+            self.session.connectToServer()
+        except OSError:
             tkinter.messagebox.showwarning("Connection Failed",
-                                           f"Cannot connect to {self.serverAddr}")
-
-    # ============================================================
-    # SEND RTSP
-    # ============================================================
-
-    def sendRtspRequest(self, code):
-        print(f"[RTSP] Sending {code}")
-
-        self.rtspSeq += 1
-        request = ""
-
-        if code == self.SETUP and self.state == self.INIT:
-            request = (
-                f"SETUP {self.fileName} RTSP/1.0\n"
-                f"CSeq: {self.rtspSeq}\n"
-                f"Transport: RTP/UDP; client_port= {self.rtpPort}\n"
-                f"Prefer: {'HD' if self.hdMode else 'SD'}"
-            )
-            self.requestSent = self.SETUP
-            threading.Thread(target=self.recvRtspReply).start()
-
-        elif code in (self.PLAY, self.PAUSE, self.TEARDOWN):
-            request = (
-                f"{code} {self.fileName} RTSP/1.0\n"
-                f"CSeq: {self.rtspSeq}\n"
-                f"Session: {self.sessionId}"
-            )
-            self.requestSent = code
-
-        self.rtspSocket.send(request.encode())
-        print("[RTSP Request Sent]\n", request)
-
-    # ============================================================
-    # RECEIVE RTSP REPLY
-    # ============================================================
-
-    def recvRtspReply(self):
-        while True:
-            try:
-                reply = self.rtspSocket.recv(1024)
-                if reply:
-                    self.parseRtspReply(reply.decode())
-                if self.requestSent == self.TEARDOWN:
-                    self.rtspSocket.close()
-                    break
-            except:
-                break
-
-    def parseRtspReply(self, data):
-        lines = data.split("\n")
-        if len(lines) < 3: 
-            return
-
-        status = int(lines[0].split(" ")[1])
-        seq = int(lines[1].split(" ")[1])
-        session = int(lines[2].split(" ")[1])
-
-        if seq != self.rtspSeq:
-            return
-
-        if self.sessionId == 0:
-            self.sessionId = session
-
-        if self.sessionId != session:
-            return
-
-        for line in lines[3:]:
-            if line.startswith("Frames"):
-                self.totalFrames = int(line.split(" ")[1])
-
-        if status == 200:
-            if self.requestSent == self.SETUP:
-                self.state = self.READY
-                self.openRtpPort()
-                print("[RTSP] SETUP OK")
-
-            elif self.requestSent == self.PLAY:
-                self.state = self.PLAYING
-                print("[RTSP] PLAY OK")
-
-            elif self.requestSent == self.PAUSE:
-                self.state = self.READY
-                self.isPaused = True
-                print("[RTSP] PAUSE OK")
-
-            elif self.requestSent == self.TEARDOWN:
-                self.state = self.INIT
-                self.playEvent.set()
-                print("[RTSP] TEARDOWN OK")
-
-    # ============================================================
-    # RTP / LISTEN
-    # ============================================================
-
-    def openRtpPort(self):
-        self.rtpSockets = []
-        for port in (self.rtpPort, self.rtpPort2):
-            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1 << 20) # 1MB buffer
-            try:
-                sock.bind(('', port))
-                sock.settimeout(0.01)
-                self.rtpSockets.append(sock)
-                print(f"[RTP] Bound to port {port}")
-            except:
-                tkinter.messagebox.showwarning("RTP Bind Failed", f"Cannot bind port {port}")
-
-    def listenRtp(self, sock):
-        expectedFrame = 1
-        frameBuffer = bytearray()
-
-        while True:
-            if hasattr(self, "playEvent") and self.playEvent.is_set():
-                break
-
-            try:
-                data = sock.recv(20480)
-            except socket.timeout:
-                continue
-            except:
-                break
-
-            if not data:
-                continue
-
-            rtp = RtpPacket()
-            rtp.decode(data)
-            frameNum = rtp.seqNum()
-            self.lastestRenderedFrame = frameNum
-            payload = rtp.getPayload()
-            marker = rtp.marker()
-
-            if self.isPaused:
-                # Buffering logic: if paused, keep buffering until 10% of total frames
-                limit = int(self.totalFrames * 0.05)
-                if self.cache.size() >= limit:
-                    if self.state == self.PLAYING and self.requestSent != self.PAUSE:
-                        print(f"[BUFFER] Cache reached 10% ({self.cache.size()}/{limit}), sending PAUSE")
-                        self.sendRtspRequest(self.PAUSE)
-                    
-                    time.sleep(0.02) # Avoid busy wait
-                    continue  # stop reading socket
-            # frame jump → reset buffer
-            if frameNum != expectedFrame:
-                frameBuffer = bytearray()
-                expectedFrame = frameNum
-
-            if not self.hdMode:
-                # SD mode: one full frame
-                if self.cache.size() >= self.maxCacheSize:
-                    continue  # skip if cache full
-                frameBuffer.extend(payload)
-                if marker == 1:
-                    if self.hd.is_valid_jpeg(frameBuffer):
-                        self.latestReceivedFrame = frameNum
-                        self.cache.push_frame(frameNum, bytes(frameBuffer))
-                    frameBuffer = bytearray()
-                    expectedFrame = frameNum + 1
-
-            else:
-                # HD mode
-                if self.cache.size() >= self.maxCacheSize:
-                    continue  # skip if cache full
-                frame = self.hd.handle_hd_payload(frameNum, payload, marker)
-                if frame:
-                    self.latestReceivedFrame = frameNum
-                    self.cache.push_frame(frameNum, frame)
-                    expectedFrame = frameNum + 1
+                                           f"Cannot connect to {self.session.serverAddr}")
 
     # ============================================================
     # PLAYER LOOP
     # ============================================================
 
     def startPlayerLoop(self):
+        session = self.session
+        if session.closed:
+            return  # torn down
         self.playerRunning = True
-        # Only buffer before the very first frame; do not stall once playback is running
-        if not self.bufferWarmed:
-            if self.cache.size() < 20 and self.frameNbr < self.totalFrames:
-                self.master.after(30, self.startPlayerLoop)
-                return
-            self.bufferWarmed = True
-        if self.state == self.PLAYING and not self.isPaused:
-            item = self.cache.pop_frame()
-            if item:
-                frameNum, frameData = item
-                try:
-                    photo = self.renderer.build_photo(frameData)
-                    self.renderer.render(photo)
-                    self.frameNbr = frameNum
-                except Exception as e:
-                    print("[Render Error]", e)
+        # Buffer the jitter buffer's target depth before (re)starting playback
+        if session.buffering():
+            self.master.after(10, self.startPlayerLoop)
+            return
+        delay = 0.03
+        if session.state == session.PLAYING and not session.isPaused:
+            # decoding runs on the pipeline's workers; here we only blit
+            self.decoder.fill()
+            if self.readyFrame is None:
+                self.readyFrame = self.decoder.next_frame()
+            if self.readyFrame is not None:
+                frameNum, img = self.readyFrame
+                wait = session.playout.due(frameNum)
+                if wait <= 0.001:
+                    self.readyFrame = None
+                    try:
+                        self.renderer.show(img)
+                        self.frameNbr = session.frameNbr = frameNum
+                    except Exception as e:
+                        print("[Render Error]", e)
+                    session.playout.markShown(frameNum)
+                    self.decoder.fill()
+                    delay = session.playout.nextDelay()
+                else:
+                    delay = wait
+            elif session.checkUnderrun(self.decoder.size()):
+                delay = 0.01  # underrun: rebuild the target depth
+            else:
+                delay = min(0.005, session.playout.interval)  # still decoding: poll
 
         # Always update progress bar to show cache filling up
         self.updateProgress(self.frameNbr)
 
-        self.master.after(30, self.startPlayerLoop)
+        self.master.after(max(1, int(delay * 1000)), self.startPlayerLoop)
 
     # ============================================================
     # PROGRESS BAR
     # ============================================================
 
     def updateProgress(self, frameNum):
-        if self.totalFrames <= 0:
+        session = self.session
+        if session.totalFrames <= 0:
             return
         
         width = self.progressCanvas.winfo_width()
@@ -396,15 +203,15 @@ class Client:
         live_val = frameNum
 
         # real cache frame = max frame inside cache, not live+size
-        cache_val = min(self.latestReceivedFrame, self.totalFrames)
+        cache_val = min(session.latestReceivedFrame, session.totalFrames)
         # print(
         #     f"[PROGRESS] live={frameNum}, "
-        #     f"latestReceived={self.latestReceivedFrame}, "
-        #     f"cacheSize={self.cache.size()}, "
-        #     f"cacheVal={cache_val}/{self.totalFrames}"
+        #     f"latestReceived={session.latestReceivedFrame}, "
+        #     f"cacheSize={session.cache.size()}, "
+        #     f"cacheVal={cache_val}/{session.totalFrames}"
         # )
-        live_frac = live_val / self.totalFrames
-        cache_frac = cache_val / self.totalFrames
+        live_frac = live_val / session.totalFrames
+        cache_frac = cache_val / session.totalFrames
 
         self.progressCanvas.coords(
             self.liveBarId, 0, 0, width * live_frac, self.progressHeight
@@ -412,3 +219,10 @@ class Client:
         self.progressCanvas.coords(
             self.cacheBarId, 0, 0, width * cache_frac, self.progressHeight
         )
+        # buffer occupancy in frames and bytes
+        self.progressCanvas.itemconfig(
+            self.bufferTextId,
+            text=f"buffer {session.cache.size()} frames / {session.cache.bytes() / 1e6:.1f} MB"
+                 f" | decode {self.decoder.stats()['decode_avg_ms']:.1f} ms"
+                 f" | skip {100 * session.playout.skipRate():.1f}%"
+        )
@@ -1,63 +1,111 @@
-import sys
+import sys, struct
 from time import time
 
 HEADER_SIZE = 12
+# BYTE 0 = V P X CC | BYTE 1 = M PT | seqnum (16) | timestamp (32) | SSRC (32)
+HEADER = struct.Struct("!BBHII")
 
+# Header extension carrying the 32-bit frame ID: profile, length (words), frame ID
+FRAME_ID_PROFILE = 0x4649  # "FI"
+EXTENSION = struct.Struct("!HHI")
+EXT_HEADER_SIZE = HEADER_SIZE + EXTENSION.size
 
-class RtpPacket:
-	header = bytearray(HEADER_SIZE)
+CLOCK_RATE = 90000  # RTP media clock for video (Hz)
 
-	def __init__(self):
-		pass
 
-	def encode(self, version, padding, extension, cc, seqnum, marker, pt, ssrc, payload):
-		"""Encode the RTP packet with header fields and payload."""
-		timestamp = int(time())
-		header = bytearray(HEADER_SIZE)
+def writeHeader(buf, offset, seqnum, timestamp, ssrc, marker=0, pt=26, version=2, frameId=None):
+	"""Pack an RTP header into a preallocated buffer (no allocation).
 
-		# BYTE 0 = V P X CC
-		header[0] = (version << 6) | (padding << 5) | (extension << 4) | (cc & 0x0F)
+	With a frameId the buffer needs EXT_HEADER_SIZE bytes: the X bit is set
+	and the frame ID follows the fixed header as a one-word extension."""
+	extension = 0 if frameId is None else 1
+	HEADER.pack_into(buf, offset, (version << 6) | (extension << 4), (marker << 7) | (pt & 0x7F),
+					 seqnum & 0xFFFF, timestamp & 0xFFFFFFFF, ssrc & 0xFFFFFFFF)
+	if extension:
+		EXTENSION.pack_into(buf, offset + HEADER_SIZE, FRAME_ID_PROFILE, 1, frameId & 0xFFFFFFFF)
 
-		# BYTE 1 = M PT
-		header[1] = (marker << 7) | (pt & 0x7F)
 
-		# BYTES 2-3 = Sequence Number (16 bits)
-		header[2] = (seqnum >> 8) & 0xFF
-		header[3] = seqnum & 0xFF
+def readHeader(buf):
+	"""Return (seqnum, timestamp, ssrc, marker, pt) without building a packet."""
+	b0, b1, seqnum, timestamp, ssrc = HEADER.unpack_from(buf)
+	return seqnum, timestamp, ssrc, b1 >> 7, b1 & 0x7F
 
-		# BYTES 4-7 = Timestamp (32 bits)
-		header[4] = (timestamp >> 24) & 0xFF
-		header[5] = (timestamp >> 16) & 0xFF
-		header[6] = (timestamp >> 8) & 0xFF
-		header[7] = timestamp & 0xFF
 
-		# BYTES 8-11 = SSRC (32 bits)
-		header[8] = (ssrc >> 24) & 0xFF
-		header[9] = (ssrc >> 16) & 0xFF
-		header[10] = (ssrc >> 8) & 0xFF
-		header[11] = ssrc & 0xFF
+class RtpPacket:
+	__slots__ = ("header", "payload")
 
-		self.header = header
+	def __init__(self):
+		self.header = bytearray(HEADER_SIZE)
+		self.payload = b''
+
+	def encode(self, version, padding, extension, cc, seqnum, marker, pt, ssrc, payload, timestamp=None, frameId=None):
+		"""Encode the RTP packet with header fields and payload.
+
+		A frameId adds the frame-ID header extension (and sets the X bit)."""
+		if timestamp is None:
+			timestamp = int(time())
+		size = HEADER_SIZE if frameId is None else EXT_HEADER_SIZE
+		if not isinstance(self.header, bytearray) or len(self.header) != size:
+			self.header = bytearray(size)
+		if frameId is not None:
+			extension = 1
+			EXTENSION.pack_into(self.header, HEADER_SIZE, FRAME_ID_PROFILE, 1, frameId & 0xFFFFFFFF)
+		HEADER.pack_into(self.header, 0,
+						 (version << 6) | (padding << 5) | (extension << 4) | (cc & 0x0F),
+						 (marker << 7) | (pt & 0x7F),
+						 seqnum & 0xFFFF, timestamp & 0xFFFFFFFF, ssrc & 0xFFFFFFFF)
 		self.payload = payload
 
 	def decode(self, byteStream):
-		"""Decode the RTP packet."""
-		self.header = bytearray(byteStream[:HEADER_SIZE])
-		self.payload = byteStream[HEADER_SIZE:]
+		"""Decode the RTP packet. Header and payload are views, not copies.
+
+		The header covers the CSRC list and any header extension."""
+		view = memoryview(byteStream)
+		size = HEADER_SIZE + 4 * (view[0] & 0x0F)
+		if view[0] & 0x10 and len(view) >= size + 4:
+			size += 4 + 4 * (view[size + 2] << 8 | view[size + 3])
+		self.header = view[:size]
+		self.payload = view[size:]
+
+	def rewrite(self, seqnum=None, timestamp=None, marker=None, ssrc=None):
+		"""Patch header fields in place (the header must be writable)."""
+		header = self.header
+		if seqnum is not None:
+			struct.pack_into("!H", header, 2, seqnum & 0xFFFF)
+		if timestamp is not None:
+			struct.pack_into("!I", header, 4, timestamp & 0xFFFFFFFF)
+		if ssrc is not None:
+			struct.pack_into("!I", header, 8, ssrc & 0xFFFFFFFF)
+		if marker is not None:
+			header[1] = (marker << 7) | (header[1] & 0x7F)
 
 	def version(self):
 		"""Return RTP version."""
 		return int(self.header[0] >> 6)
 
 	def seqNum(self):
-		"""Return sequence (frame) number."""
-		seqNum = self.header[2] << 8 | self.header[3]
-		return int(seqNum)
+		"""Return sequence number (per packet)."""
+		return self.header[2] << 8 | self.header[3]
+
+	def frameId(self):
+		"""Return the 32-bit frame ID from the header extension.
+
+		Streams without the extension fall back to the sequence number, which
+		is what older servers put the frame number in."""
+		offset = HEADER_SIZE + 4 * (self.header[0] & 0x0F)
+		if self.header[0] & 0x10 and len(self.header) >= offset + EXTENSION.size:
+			profile, length, frameId = EXTENSION.unpack_from(self.header, offset)
+			if profile == FRAME_ID_PROFILE:
+				return frameId
+		return self.seqNum()
 
 	def timestamp(self):
 		"""Return timestamp."""
-		timestamp = self.header[4] << 24 | self.header[5] << 16 | self.header[6] << 8 | self.header[7]
-		return int(timestamp)
+		return HEADER.unpack_from(self.header)[3]
+
+	def ssrc(self):
+		"""Return SSRC."""
+		return HEADER.unpack_from(self.header)[4]
 
 	def marker(self):
 		"""Return marker bit (1 when packet ends a frame)."""
@@ -65,8 +113,7 @@ class RtpPacket:
 
 	def payloadType(self):
 		"""Return payload type."""
-		pt = self.header[1] & 127
-		return int(pt)
+		return self.header[1] & 127
 
 	def getPayload(self):
 		"""Return payload."""
@@ -74,4 +121,4 @@ class RtpPacket:
 
 	def getPacket(self):
 		"""Return RTP packet."""
-		return self.header + self.payload
+		return b''.join((self.header, self.payload))
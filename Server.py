@@ -1,26 +1,108 @@
-import sys, socket
+import argparse, os, socket
 
 from ServerWorker import ServerWorker
+from frame_cache import FrameCache
+from packet_store import PacketStore
+from pacer import PacingPolicy
+from renditions import RenditionStore
+from rtcp import RtcpDemux, RtcpListener
+from metrics import MetricsRegistry, MetricsServer
 
 class Server:	
+	# Default byte budget of the frame cache shared by all sessions
+	FRAME_CACHE_MB = 256
+	# Default byte budget of the pre-fragmented HD packet store
+	PACKET_STORE_MB = 256
 	
 	def main(self):
-		try:
-			SERVER_PORT = int(sys.argv[1])
-			print("Server port:", SERVER_PORT)
-		except:
-			print("[Usage: Server.py Server_port]\n")
-		rtspSocket = socket.socket(socket.AF_INET, socket.SOCK_STREAM) # Create a TCP socket
-		rtspSocket.bind(('', SERVER_PORT)) 
-		rtspSocket.listen(5)  # max. 5 clients can queue up   
+		parser = argparse.ArgumentParser(description="RTSP/RTP video streaming server")
+		parser.add_argument("port", type=int, help="RTSP port")
+		parser.add_argument("cache_mb", type=int, nargs="?", default=self.FRAME_CACHE_MB,
+							help="shared frame cache budget in MB (split between --workers)")
+		parser.add_argument("--engine", choices=("thread", "async"), default="thread",
+							help="thread-per-session workers or one asyncio event loop")
+		parser.add_argument("--packet-store-mb", type=int, default=self.PACKET_STORE_MB,
+							help="budget of the shared pre-fragmented HD packet store in MB (split between --workers)")
+		parser.add_argument("--session-rate-mbps", type=float, default=0,
+							help="per-session pacing rate (0 = only spread packets over the frame)")
+		parser.add_argument("--global-rate-mbps", type=float, default=0,
+							help="aggregate pacing rate for all sessions (0 = unlimited; split between --workers)")
+		parser.add_argument("--burst-kb", type=int, default=64,
+							help="token bucket depth for pacing")
+		parser.add_argument("--fec-min-group", type=int, default=ServerWorker.FEC_MIN_GROUP,
+							help="smallest HD FEC group a client may ask for, i.e. at most "
+								 "1/N parity overhead (0 = no FEC)")
+		parser.add_argument("--retransmit-frames", type=int, default=ServerWorker.RETRANSMIT_FRAMES,
+							help="HD frames kept per session for NACK retransmission (0 = off)")
+		parser.add_argument("--no-abr", action="store_true",
+							help="stream HD at source quality only (no rendition ladder)")
+		parser.add_argument("--metrics-port", type=int, default=0,
+							help="serve Prometheus metrics on http://127.0.0.1:PORT/metrics (0 = off)")
+		parser.add_argument("--workers", type=int, default=1,
+							help="server processes sharing the port via SO_REUSEPORT (0 = one per core)")
+		args = parser.parse_args()
+		ServerWorker.FEC_MIN_GROUP = args.fec_min_group
+		ServerWorker.RETRANSMIT_FRAMES = args.retransmit_frames
+
+		workers = args.workers or os.cpu_count() or 1
+		if workers > 1:
+			if not hasattr(socket, "SO_REUSEPORT"):
+				parser.error("--workers needs SO_REUSEPORT (Linux)")
+			from prefork import Supervisor
+			Supervisor(self, args, workers).run()
+			return
+		self.serve(args)
+
+	def serve(self, args, worker=None):
+		"""Run one server process: standalone, or as prefork `worker` (which
+		brings the shared listener, its RTCP port offset and HD handoff)."""
+		SERVER_PORT = args.port
+		print("Server port:", SERVER_PORT)
+		# cache budgets and the aggregate rate are for the whole server: split
+		# them between prefork workers
+		share = worker.load.workers if worker else 1
+		frameCache = FrameCache(max_bytes=args.cache_mb * 1024 * 1024 // share)
+		packetStore = PacketStore(max_bytes=args.packet_store_mb * 1024 * 1024 // share)
+		pacing = PacingPolicy(args.session_rate_mbps, args.global_rate_mbps / share, args.burst_kb)
+		renditions = None if args.no_abr else RenditionStore()
+		# receiver reports arrive on the companion UDP port RTSP port + 1
+		# (+ 1 + i for prefork worker i)
+		rtcp = RtcpDemux(SERVER_PORT + 1 + (worker.index if worker else 0))
+		metrics = MetricsRegistry(frameCache, packetStore, rtcp)
+		handoff = None
+		if worker is not None:
+			worker.attach(metrics)  # the supervisor serves the aggregate
+			handoff = worker.handoff
+		elif args.metrics_port:
+			MetricsServer(metrics, args.metrics_port).start()
+			print("Metrics on http://127.0.0.1:%d/metrics" % args.metrics_port)
+
+		if args.engine == "async":
+			from async_server import AsyncServer
+			AsyncServer(SERVER_PORT, frameCache, packetStore, pacing, renditions, rtcp, metrics,
+						handoff, worker.listener if worker else None).run()
+			return
+
+		if worker is not None:
+			rtspSocket = worker.listener
+		else:
+			rtspSocket = socket.socket(socket.AF_INET, socket.SOCK_STREAM) # Create a TCP socket
+			rtspSocket.bind(('', SERVER_PORT)) 
+			rtspSocket.listen(5)  # max. 5 clients can queue up   
+		RtcpListener(rtcp).start()
+
+		def newSession(clientInfo):
+			return ServerWorker(clientInfo, frameCache, packetStore, pacing, renditions, rtcp, metrics,
+								handoff)
+		if handoff is not None:
+			# HD clients handed over by busier workers, first request already read
+			handoff.listen(lambda sock, data: newSession({'rtspSocket': (sock, sock.getpeername())}).run(data))
 
 		# Receive client info (address,port) through RTSP/TCP session
 		while True:
 			clientInfo = {}
 			clientInfo['rtspSocket'] = rtspSocket.accept()
-			ServerWorker(clientInfo).run()		
+			newSession(clientInfo).run()		
 
 if __name__ == "__main__":
 	(Server()).main() 
-
-
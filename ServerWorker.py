@@ -1,10 +1,17 @@
-from random import randint
-from time import time, sleep
-import sys, traceback, threading, socket, io
+from random import randint, getrandbits
+from time import monotonic
+import sys, traceback, threading, socket, io, math
 from PIL import Image
 
 from VideoStream import VideoStream
-from RtpPacket import RtpPacket
+from RtpPacket import RtpPacket, EXT_HEADER_SIZE, CLOCK_RATE, writeHeader
+from udp_batch import BatchSender
+from packet_store import fragmentFrame
+from fec import addParity
+from retransmit import RetransmitRing
+from pacer import PacingPolicy
+from abr import AbrController
+from metrics import SessionMetrics
 
 
 class ServerWorker:
@@ -12,6 +19,7 @@ class ServerWorker:
 	PLAY = 'PLAY'
 	PAUSE = 'PAUSE'
 	TEARDOWN = 'TEARDOWN'
+	GET_PARAMETER = 'GET_PARAMETER'
 	
 	INIT = 0
 	READY = 1
@@ -21,29 +29,73 @@ class ServerWorker:
 	OK_200 = 0
 	FILE_NOT_FOUND_404 = 1
 	CON_ERR_500 = 2
+	INVALID_RANGE_457 = 3
+	METHOD_NOT_VALID_455 = 4
 
 	# For HD, skip downscaling to avoid CPU overhead; keep original quality
 	DOWNSCALE_HD = False
 	HD_MAX_W = 960
 	HD_MAX_H = 540
 	HD_QUALITY = 65  # unused when DOWNSCALE_HD is False
+
+	SD_FRAME_INTERVAL = 0.04  # 25 fps
+	HD_FRAME_INTERVAL = 0.02  # 50 fps
+	MAX_RTP_PAYLOAD = 1200  # HD fragment size, stays under MTU
+	BATCH_PACKETS = 8  # HD fragments handed to the kernel per paced send
+	RTP_PT = 26  # MJPEG payload type
+	# Smallest FEC group a client may negotiate (most overhead: 1 parity per
+	# FEC_MIN_GROUP fragments); 0 turns FEC off
+	FEC_MIN_GROUP = 4
+	# NACK retransmission: HD frames kept per session (0 = off), how long
+	# they stay worth resending, and the most packets resent per NACK
+	RETRANSMIT_FRAMES = 32
+	RETRANSMIT_MAX_AGE = 1.0
+	NACK_MAX_PACKETS = 64
 	
 	clientInfo = {}
 	
-	def __init__(self, clientInfo):
+	def __init__(self, clientInfo, frameCache=None, packetStore=None, pacing=None, renditions=None,
+				 rtcp=None, metrics=None, handoff=None):
 		self.clientInfo = clientInfo
+		self.frameCache = frameCache  # FrameCache shared by all sessions
+		self.packetStore = packetStore  # PacketStore shared by all HD sessions
+		self.pacing = pacing or PacingPolicy()  # rate limits + global token bucket
+		self.renditions = renditions  # RenditionStore for adaptive bitrate, or None
+		self.abr = None
+		self.rtcp = rtcp  # RtcpDemux delivering this session's receiver reports
+		self.transportStats = {}  # latest receiver report + report count
+		self.lastReport = None  # (time, bytes sent) at the previous receiver report
+		self.retransmit = None  # RetransmitRing of recent HD frames
+		self.metrics = metrics  # MetricsRegistry exporting this session, or None
+		self.sessionMetrics = SessionMetrics()
+		self.handoff = handoff  # prefork Handoff to move HD clients to a quieter worker
 		
-	def run(self):
-		threading.Thread(target=self.recvRtspRequest).start()
+	def run(self, data=None):
+		threading.Thread(target=self.recvRtspRequest, args=(data,)).start()
 	
-	def recvRtspRequest(self):
-		"""Receive RTSP request from the client."""
+	def recvRtspRequest(self, data=None):
+		"""Receive RTSP request from the client (`data`: already read by the
+		prefork worker that handed this connection over)."""
 		connSocket = self.clientInfo['rtspSocket'][0]
-		while True:            
-			data = connSocket.recv(256)
-			if data:
-				print("Data received:\n" + data.decode("utf-8"))
-				self.processRtspRequest(data.decode("utf-8"))
+		if data is None:
+			data = connSocket.recv(1024)
+			if data and self.handoff is not None and self.handoff.offer(connSocket, data):
+				connSocket.close()
+				return  # another worker serves this client now
+		while data:            
+			print("Data received:\n" + data.decode("utf-8"))
+			self.processRtspData(data.decode("utf-8"))
+			data = connSocket.recv(1024)
+		if self.state != self.INIT:
+			self.stopStreaming()
+			self.closeSession()
+
+	def processRtspData(self, data):
+		"""Requests end with a blank line, so one read may hold several
+		(e.g. a PAUSE right behind a PLAY)."""
+		for request in data.split('\n\n'):
+			if request.strip():
+				self.processRtspRequest(request.strip('\n'))
 	
 	def processRtspRequest(self, data):
 		"""Process RTSP request sent from the client."""
@@ -65,9 +117,15 @@ class ServerWorker:
 		# Detect HD preference
 		if requestType == self.SETUP:
 			self.isHD = False
+			self.fecGroup = 0
 			for line in request:
 				if "Prefer:" in line and "HD" in line:
 					self.isHD = True
+				elif line.startswith("Fec:"):
+					# client asks for one parity packet per K HD fragments
+					requested = int(line.split(' ')[1])
+					if requested > 0 and self.FEC_MIN_GROUP > 0:
+						self.fecGroup = max(requested, self.FEC_MIN_GROUP)
 		# Process SETUP request
 		if requestType == self.SETUP:
 			if self.state == self.INIT:
@@ -83,7 +141,7 @@ class ServerWorker:
 				filename_to_open = filename
 
 			try:
-				self.clientInfo['videoStream'] = VideoStream(filename_to_open, mode="hd" if self.isHD else "normal")
+				self.clientInfo['videoStream'] = VideoStream(filename_to_open, mode="hd" if self.isHD else "normal", cache=self.frameCache)
 				self.state = self.READY
 			except IOError:
 				self.replyRtsp(self.FILE_NOT_FOUND_404, seq[1])
@@ -91,46 +149,57 @@ class ServerWorker:
 
 			# Generate a randomized RTSP session ID
 			self.clientInfo['session'] = randint(100000, 999999)
+			# Random SSRC, initial sequence number and timestamp offset (RFC 3550)
+			if self.rtcp is not None and hasattr(self, 'ssrc'):
+				self.rtcp.unregister(self.ssrc)
+			self.ssrc = getrandbits(32)
+			self.rtpSeq = getrandbits(16)
+			self.tsBase = getrandbits(32)
+			if self.rtcp is not None:
+				self.rtcp.register(self.ssrc, self)
+			self.registerMetrics()
 				
+			if self.isHD and self.renditions is not None:
+				self.setupAbr()
+			if self.isHD and self.RETRANSMIT_FRAMES > 0:
+				self.retransmit = RetransmitRing(self.RETRANSMIT_FRAMES, self.RETRANSMIT_MAX_AGE)
+
 			# Send RTSP reply
-			self.replyRtsp(self.OK_200, seq[1], total_frames=self.clientInfo['videoStream'].totalFrames)
+			self.replyRtsp(self.OK_200, seq[1], total_frames=self.clientInfo['videoStream'].totalFrames,
+						   fps=1 / self.frameInterval(),
+						   rtcp_port=self.rtcp.port if self.rtcp is not None else None,
+						   fec=self.fecGroup if self.isHD else 0)
 				
 			# Get the RTP/UDP port from the last line (primary port). Secondary port is +2.
 			self.clientInfo['rtpPort'] = int(request[2].split(' ')[3])
 			self.clientInfo['rtpPort2'] = self.clientInfo['rtpPort'] + 2
 		
-		# Process PLAY request 		
+		# Process PLAY request (a Range header seeks, also while playing)
 		elif requestType == self.PLAY:
-			if self.state == self.READY:
+			if self.state == self.INIT:
+				self.replyRtsp(self.METHOD_NOT_VALID_455, seq[1])  # PLAY before SETUP
+				return
+			try:
+				start = self.parseRange(request)
+			except (ValueError, OverflowError):
+				self.replyRtsp(self.INVALID_RANGE_457, seq[1])
+				return
+			if self.state == self.READY or (self.state == self.PLAYING and start is not None):
 				print("processing PLAY\n")
+				if self.state == self.PLAYING:
+					self.stopStreaming()
+				if start is not None:
+					self.seekTo(start)
 				self.state = self.PLAYING
-				
-				self.clientInfo["rtpSocket"] = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-				# Enlarge send buffer to reduce drop
-				try:
-					self.clientInfo["rtpSocket"].setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, 1 << 20) # tăng buffer để tránh drop
-				except Exception as exc:
-					print("Cannot set SO_SNDBUF:", exc)
-
-				self.replyRtsp(self.OK_200, seq[1])
-
-				self.clientInfo['event'] = threading.Event()
-
-				if self.isHD:
-					print(">> Using HD sendRtpHD()")
-					self.clientInfo['worker'] = threading.Thread(target=self.sendRtpHD)
-				else:
-					print(">> Using SD sendRtp()")
-					self.clientInfo['worker'] = threading.Thread(target=self.sendRtp)
-
-				self.clientInfo['worker'].start()
+				self.replyRtsp(self.OK_200, seq[1], range_start=start)
+				self.startStreaming()
 		# Process PAUSE request
 		elif requestType == self.PAUSE:
 			if self.state == self.PLAYING:
 				print("processing PAUSE\n")
 				self.state = self.READY
 				
-				self.clientInfo['event'].set() # stop sending RTP packets
+				self.stopStreaming() # stop sending RTP packets
 			
 				self.replyRtsp(self.OK_200, seq[1])
 		
@@ -138,24 +207,110 @@ class ServerWorker:
 		elif requestType == self.TEARDOWN:
 			print("processing TEARDOWN\n")
 			self.state = self.INIT
-			self.clientInfo['event'].set() # stop sending RTP packets
+			self.stopStreaming() # stop sending RTP packets
 			
 			self.replyRtsp(self.OK_200, seq[1]) # send RTSP reply
 			
-			# Close the RTP socket
-			self.clientInfo['rtpSocket'].close()
+			self.closeSession()
+
+		# Process GET_PARAMETER request (session statistics, one "name: value" per line)
+		elif requestType == self.GET_PARAMETER:
+			if self.state == self.INIT:
+				self.replyRtsp(self.METHOD_NOT_VALID_455, seq[1])  # no session yet
+				return
+			body = ''.join('%s: %s\n' % item for item in self.sessionMetrics.snapshot().items())
+			self.replyRtsp(self.OK_200, seq[1], body=body)
+
+	def startStreaming(self):
+		"""Open the RTP socket (once per session) and start the sender thread."""
+		if 'rtpSocket' not in self.clientInfo:
+			self.clientInfo["rtpSocket"] = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+			# Enlarge send buffer to reduce drop
+			try:
+				self.clientInfo["rtpSocket"].setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, 1 << 20) # tăng buffer để tránh drop
+			except Exception as exc:
+				print("Cannot set SO_SNDBUF:", exc)
+			self.clientInfo['rtpSender'] = BatchSender(self.clientInfo["rtpSocket"])
+		self.clientInfo['pacer'] = self.pacing.newPacer()
+
+		self.clientInfo['event'] = threading.Event()
+
+		if self.isHD:
+			print(">> Using HD sendRtpHD()")
+			self.clientInfo['worker'] = threading.Thread(target=self.sendRtpHD)
+		else:
+			print(">> Using SD sendRtp()")
+			self.clientInfo['worker'] = threading.Thread(target=self.sendRtp)
+
+		self.clientInfo['worker'].start()
+
+	def stopStreaming(self):
+		"""Stop the sender thread (PAUSE/TEARDOWN/seek) and wait for it, so
+		the stream position and RTP sequence number are ours again."""
+		if 'event' in self.clientInfo:
+			self.clientInfo['event'].set()
+			worker = self.clientInfo.get('worker')
+			if worker is not None and worker is not threading.current_thread():
+				worker.join()
+
+	def parseRange(self, request):
+		"""First frame (1-based) of a PLAY Range header, "npt=<seconds>-" or
+		"frame=<n>-"; None without one. Raises ValueError if malformed,
+		infinite or negative."""
+		for line in request:
+			if line.startswith("Range:"):
+				unit, _, spec = line.split(':', 1)[1].strip().partition('=')
+				first = spec.split('-')[0].strip()
+				if unit == 'npt':
+					if first in ('', 'now'):
+						return None
+					seconds = float(first)
+					if not math.isfinite(seconds) or seconds < 0:
+						raise ValueError("invalid npt: " + first)
+					return round(seconds / self.frameInterval()) + 1
+				if unit == 'frame':
+					frame = int(first)
+					if frame < 0:
+						raise ValueError("invalid frame: " + first)
+					return frame
+				raise ValueError("unsupported Range unit: " + unit)
+		return None
+
+	def seekTo(self, frameNum):
+		"""Next frame sent is frameNum (clamped to the stream)."""
+		stream = self.clientInfo['videoStream']
+		stream.seek(max(1, min(frameNum, stream.totalFrames)))
+		if self.retransmit is not None:
+			self.retransmit.clear()  # NACKs refer to the old position
+		print("[SEEK] -> frame", stream.frameNbr() + 1)
+
+	def closeSession(self):
+		"""Release the RTP socket and the video stream after TEARDOWN."""
+		self.closeRtcp()
+		self.unregisterMetrics()
+		if 'rtpSocket' in self.clientInfo:
+			self.clientInfo.pop('rtpSocket').close()
+		if 'videoStream' in self.clientInfo:
+			self.clientInfo['videoStream'].close()
+		if self.frameCache is not None:
+			print("[CACHE]", self.frameCache.stats())
+		if self.packetStore is not None:
+			print("[PACKET STORE]", self.packetStore.stats())
 
 	def sendRtp(self):
 		"""Send RTP packets over UDP (single packet per frame)."""
-		# Target ~60 fps to speed up playback
-		frame_interval = 0.04
-		next_send = time()
+		frame_interval = self.SD_FRAME_INTERVAL
+		pacer = self.clientInfo['pacer']
+		metrics = self.sessionMetrics
+		next_send = monotonic()
 		while True:
 			if self.clientInfo['event'].isSet():
 				break
 			# print ("Sending frame number:", self.clientInfo['videoStream'].frameNbr())
-			# print("Sending frame number:", self.clientInfo['videoStream'].frameNbr())
+			started = monotonic()
+			metrics.lateness.observe(max(0, started - next_send))
 			data = self.clientInfo['videoStream'].nextFrame()
+			metrics.readLatency.observe(monotonic() - started)
 
 			if data:
 				frameNumber = self.clientInfo['videoStream'].frameNbr()
@@ -163,7 +318,13 @@ class ServerWorker:
 					address = self.clientInfo['rtspSocket'][1][0]
 					port = int(self.clientInfo['rtpPort'])
 					packet = self.makeRtp(data, frameNumber, marker=1)
+					delay = pacer.reserve(len(packet))
+					if delay > 0 and self.clientInfo['event'].wait(delay):
+						break
+					sent = monotonic()
 					self.clientInfo['rtpSocket'].sendto(packet, (address, port))
+					metrics.sendLatency.observe(monotonic() - sent)
+					metrics.onFrame(1, len(packet))
 				except:
 					print("Connection Error")
 			else:
@@ -172,97 +333,324 @@ class ServerWorker:
 				break
 			# Pace the stream to target fps but stay responsive to pause
 			next_send += frame_interval
-			wait_time = max(0, next_send - time())
+			wait_time = max(0, next_send - monotonic())
 			if self.clientInfo['event'].wait(wait_time):
 				break
 		print("[SERVER] RTP stream paused/stopped")
 
 
 	def sendRtpHD(self):
-		"""Send RTP packets for HD video (supports fragmentation)."""
-		MAX_RTP_PAYLOAD = 1200  # stay under MTU
-		frame_interval = 0.02  # send as fast as possible
-		next_send = time()
+		"""Send RTP packets for HD video (supports fragmentation).
+
+		Each frame's packets go out in batches spread over the frame interval
+		by the session pacer (token buckets on a monotonic clock)."""
+		frame_interval = self.frameInterval()
+		pacer = self.clientInfo['pacer']
+		event = self.clientInfo['event']
+		metrics = self.sessionMetrics
+		next_send = monotonic()
 
 		while True:
-			if self.clientInfo['event'].isSet():
+			if event.isSet():
 				break
 
 			# Send exactly one frame per loop iteration
-			frame = self.clientInfo['videoStream'].nextFrame()
-			if not frame:
+			started = monotonic()
+			metrics.lateness.observe(max(0, started - next_send))
+			packets = self.nextHdPackets()
+			metrics.readLatency.observe(monotonic() - started)
+			if packets is None:
 				print("[SERVER] End of HD video reached. Stopping RTP stream.")
-				self.clientInfo['event'].set()
+				event.set()
 				break
 
-			if self.DOWNSCALE_HD:
-				frame = self.downscale_frame(frame)
-
-			frameNum = self.clientInfo['videoStream'].frameNbr()
-			chunks = [
-				frame[i:i + MAX_RTP_PAYLOAD]
-				for i in range(0, len(frame), MAX_RTP_PAYLOAD)]
-			total_chunks = len(chunks)
-			# print(f"[SERVER] Sending HD frame: {frameNum} ({total_chunks} chunks)")
-
-			for idx, chunk in enumerate(chunks):
-				if self.clientInfo['event'].isSet():
+			batches = range(0, len(packets), self.BATCH_PACKETS)
+			start = monotonic()
+			for n, i in enumerate(batches):
+				batch = packets[i:i + self.BATCH_PACKETS]
+				delay = pacer.slot(start, n, len(batches), frame_interval) - monotonic()
+				delay = max(delay, pacer.reserve(self.batchBytes(batch)))
+				if delay > 0 and event.wait(delay):
 					return
 				try:
-					marker = 1 if idx == len(chunks) - 1 else 0  # mark the last packet of the frame
-					prefixed_chunk = idx.to_bytes(2, "big") + total_chunks.to_bytes(2, "big") + chunk
-					packet = self.makeRtp(prefixed_chunk, frameNum, marker=marker)
-					address = self.clientInfo['rtspSocket'][1][0]
-					if idx % 2 == 0:
-						port = self.clientInfo['rtpPort']
-					else:
-						port = self.clientInfo['rtpPort2']
-					self.clientInfo['rtpSocket'].sendto(packet, (address, port))
-					sleep(0.001) # pace packets to avoid burst loss
-				except:
+					sent = monotonic()
+					self.clientInfo['rtpSender'].send(batch)
+					metrics.sendLatency.observe(monotonic() - sent)
+				except OSError:
 					print("Connection Error (HD)")
 					break
+			metrics.onFrame(len(packets), self.batchBytes(packets))
 
-			if frame_interval > 0:
-				next_send += frame_interval
-				wait_time = max(0, next_send - time())
-				if self.clientInfo['event'].wait(wait_time):
-					break
-			else:
-				if self.clientInfo['event'].wait(0.001):
-					break
+			next_send += frame_interval
+			now = monotonic()
+			if next_send < now - frame_interval:
+				next_send = now  # fell behind (rate limit): do not burst to catch up
+			if event.wait(max(0, next_send - now)):
+				break
 		print("[SERVER] HD RTP stream paused/stopped")
 
+	@staticmethod
+	def batchBytes(batch):
+		return sum(len(part) for parts, _ in batch for part in parts)
+
+	def nextHdPackets(self):
+		"""Advance to the next HD frame and return its packets, or None at the end.
+
+		Each packet is ((RTP header, payload), address): the payloads come
+		from the shared packet store and only the headers belong to this
+		session, so they are rewritten in place for every frame."""
+		if self.abr is not None:
+			self.applyRendition()
+		stream = self.clientInfo['videoStream']
+		frameNum = stream.frameNbr() + 1
+		fragments = self.hdFragments(stream, frameNum)
+		if fragments is None:
+			return None
+		stream.seek(frameNum + 1)
+
+		headers = self.headerPool(len(fragments))
+		timestamp = self.rtpTimestamp(frameNum)
+		address = self.clientInfo['rtspSocket'][1][0]
+		ports = (self.clientInfo['rtpPort'], self.clientInfo['rtpPort2'])
+		last = len(fragments) - 1
+		seq = self.rtpSeq
+		packets = []
+		for idx, fragment in enumerate(fragments):
+			marker = 1 if idx == last else 0  # mark the last packet of the frame
+			header = headers[idx]
+			writeHeader(header, 0, seq + idx, timestamp, self.ssrc, marker, self.RTP_PT,
+						frameId=frameNum)
+			packets.append(((header, fragment), (address, ports[idx % 2])))
+		self.rtpSeq = (seq + len(fragments)) & 0xFFFF
+		if self.retransmit is not None:
+			self.retransmit.add(frameNum, packets)
+		return packets
+
+	def setupAbr(self):
+		"""Rendition ladder and controller for this HD session; missing
+		renditions start transcoding in the background now."""
+		stream = self.clientInfo['videoStream']
+		self.ladder = self.renditions.renditions(stream)
+		if len(self.ladder) < 2:
+			return
+		self.source = (stream.filename, stream.mode)
+		for rendition in self.ladder[1:]:
+			self.renditions.request(*self.source, rendition)
+		# bit/s of the source; the others are estimated by pixel count until opened
+		sourceRate = self.streamBitrate(stream)
+		sw, sh = self.renditions.sizes[stream.filename]
+		bitrates = [sourceRate] + [sourceRate * min(1, w * h / (sw * sh))
+								   for _, w, h, _ in self.ladder[1:]]
+		self.abr = AbrController(bitrates, rateCap=self.pacing.sessionRate * 8)
+		self.renditionIndex = 0
+
+	def streamBitrate(self, stream):
+		if not stream.totalFrames:
+			return 0
+		return sum(stream.lengths) * 8 / (stream.totalFrames * self.frameInterval())
+
+	def onReceiverReport(self, report, addr):
+		"""RTCP receiver report for this session (called from the RTCP listener)."""
+		if addr[0] != self.clientInfo['rtspSocket'][1][0]:
+			return  # only the RTSP client may report on its stream
+		report['reports'] = self.transportStats.get('reports', 0) + 1
+		self.transportStats = report
+		# what we sent since the previous report, to compare with what arrived
+		now, sentBytes = monotonic(), self.sessionMetrics.bytesSent
+		sent = None
+		if self.lastReport is not None and now > self.lastReport[0] and sentBytes >= self.lastReport[1]:
+			sent = (sentBytes - self.lastReport[1]) * 8 / (now - self.lastReport[0])
+		self.lastReport = (now, sentBytes)
+		if self.abr is not None and 'throughput' in report:
+			self.onFeedback(report['fraction_lost'], report['throughput'], sent)
+
+	def onNack(self, frameId, playhead, indices, addr):
+		"""Client lost these fragments of frameId: resend them from the ring
+		unless its playout has passed the frame already."""
+		if self.retransmit is None or addr[0] != self.clientInfo['rtspSocket'][1][0]:
+			return
+		packets = self.retransmit.lookup(frameId, indices[:self.NACK_MAX_PACKETS], playhead)
+		if packets:
+			self.sendRetransmit(packets)
+
+	def sendRetransmit(self, packets):
+		"""Resend packets right away (RTCP thread); they still take tokens
+		from the session's buckets so the paced stream makes room for them."""
+		pacer = self.clientInfo.get('pacer')
+		if pacer is not None:
+			pacer.reserve(self.batchBytes(packets))
+		self.sessionMetrics.retransmitted += len(packets)
+		sock = self.clientInfo.get('rtpSocket')
+		if sock is None:
+			return
+		for parts, address in packets:
+			try:
+				sock.sendto(b''.join(parts), address)
+			except OSError:
+				print("Connection Error (retransmit)")
+				break
+
+	def registerMetrics(self):
+		"""Fresh counters for the new RTSP session, exported if the server
+		has a metrics registry."""
+		self.unregisterMetrics()
+		self.sessionMetrics = SessionMetrics(self.clientInfo['session'], "hd" if self.isHD else "sd",
+											 1 / self.frameInterval())
+		if self.metrics is not None:
+			self.metrics.register(self.sessionMetrics)
+
+	def unregisterMetrics(self):
+		if self.metrics is not None:
+			self.metrics.unregister(self.sessionMetrics)
+
+	def closeRtcp(self):
+		if self.rtcp is not None and hasattr(self, 'ssrc'):
+			self.rtcp.unregister(self.ssrc)
+		if self.retransmit is not None:
+			print("[NACK]", self.retransmit.stats())
+			self.retransmit.clear()
+		if self.transportStats:
+			stats = self.transportStats
+			print(f"[RTCP] {stats['reports']} reports, lost {stats['cumulative_lost']},"
+				  f" jitter {stats['jitter'] * 1e3:.1f} ms,"
+				  f" frames {stats.get('frames_completed')}/{stats.get('frames_dropped')} ok/dropped")
+
+	def onFeedback(self, loss, throughput, sent=None):
+		"""Client report: pick the rendition; the sender switches at the next frame."""
+		source = self.source[0]
+		index = self.abr.onFeedback(
+			loss, throughput, sent,
+			available=lambda i: self.renditions.ready(source, self.ladder[i][0]))
+		if index != self.renditionIndex:
+			print(f"[ABR] loss {loss:.1%}, {throughput / 1e6:.1f} Mbit/s"
+				  f" -> {self.ladder[index][0]}")
+			self.clientInfo['pendingRendition'] = index
+
+	def applyRendition(self):
+		"""Switch streams at a frame boundary (sender side)."""
+		index = self.clientInfo.pop('pendingRendition', None)
+		if index is None or index == self.renditionIndex:
+			return
+		old = self.clientInfo['videoStream']
+		try:
+			new = self.renditions.open(*self.source, self.ladder[index][0], cache=self.frameCache)
+		except OSError as exc:
+			print("[ABR] Cannot open rendition:", exc)
+			return
+		if new.totalFrames != old.totalFrames:
+			print("[ABR] Rendition frame count mismatch, not switching")
+			new.close()
+			return
+		new.seek(old.frameNbr() + 1)
+		self.clientInfo['videoStream'] = new
+		self.renditionIndex = index
+		self.abr.bitrates[index] = self.streamBitrate(new)
+		old.close()
+
+	def hdFragments(self, stream, frameNum):
+		"""RTP payloads of an HD frame, fragmented once (plus FEC parity) and
+		shared via the packet store."""
+		key = (stream.cacheKey, frameNum, self.MAX_RTP_PAYLOAD, self.DOWNSCALE_HD, self.fecGroup)
+		if self.packetStore is not None:
+			fragments = self.packetStore.get(key)
+			if fragments is not None:
+				return fragments
+
+		# the packet store keeps the fragments: caching the frame too would
+		# hold every HD frame twice
+		frame = stream.frameView(frameNum) if self.packetStore is not None else stream.frameAt(frameNum)
+		if not frame:
+			return None
+		if self.DOWNSCALE_HD:
+			frame = self.downscale_frame(frame)
+		fragments = fragmentFrame(frame, self.MAX_RTP_PAYLOAD)
+		if self.fecGroup:
+			fragments = addParity(fragments, self.fecGroup, self.MAX_RTP_PAYLOAD)
+		if self.packetStore is not None:
+			self.packetStore.put(key, fragments)
+		return fragments
+
+	def headerPool(self, count):
+		"""Per-session RTP header buffers, reused from frame to frame."""
+		pool = self.clientInfo.setdefault('rtpHeaders', [])
+		if len(pool) < count:
+			block = memoryview(bytearray(EXT_HEADER_SIZE * (count - len(pool))))
+			pool.extend(block[i:i + EXT_HEADER_SIZE]
+						for i in range(0, len(block), EXT_HEADER_SIZE))
+		return pool
+
 	def makeRtp(self, payload, frameNbr, marker=0):
 		"""RTP-packetize the video data."""
+		return self.makeRtpHeader(frameNbr, marker) + payload
+
+	def makeRtpHeader(self, frameNbr, marker=0):
+		"""Build the RTP header alone (payload is sent separately).
+
+		Uses the next per-packet sequence number; the frame number travels
+		as the 32-bit frame ID header extension."""
 		version = 2
 		padding = 0
-		extension = 0
+		extension = 1
 		cc = 0
-		pt = 26 # MJPEG type
-		seqnum = frameNbr
-		ssrc = 0 
+		pt = self.RTP_PT # MJPEG type
+		seqnum = self.rtpSeq
+		self.rtpSeq = (self.rtpSeq + 1) & 0xFFFF
 		
 		rtpPacket = RtpPacket()
 		
-		rtpPacket.encode(version, padding, extension, cc, seqnum, marker, pt, ssrc, payload)
+		rtpPacket.encode(version, padding, extension, cc, seqnum, marker, pt, self.ssrc, b'',
+						 timestamp=self.rtpTimestamp(frameNbr), frameId=frameNbr)
 		
-		return rtpPacket.getPacket()
+		return rtpPacket.header
+
+	def frameInterval(self):
+		"""Seconds between frames for this session."""
+		return self.HD_FRAME_INTERVAL if self.isHD else self.SD_FRAME_INTERVAL
+
+	def rtpTimestamp(self, frameNbr):
+		"""90 kHz media clock derived from the frame index and the frame rate."""
+		return (self.tsBase + round((frameNbr - 1) * self.frameInterval() * CLOCK_RATE)) & 0xFFFFFFFF
 			
-	def replyRtsp(self, code, seq, total_frames=None):
+	def replyRtsp(self, code, seq, total_frames=None, fps=None, rtcp_port=None, fec=None, body=None,
+				  range_start=None):
 		"""Send RTSP reply to the client."""
 		if code == self.OK_200:
 			reply = 'RTSP/1.0 200 OK\nCSeq: ' + seq + '\nSession: ' + str(self.clientInfo['session'])
 			if total_frames is not None:
 				reply += '\nFrames: ' + str(total_frames)
-			connSocket = self.clientInfo['rtspSocket'][0]
-			connSocket.send(reply.encode())
+			if fps is not None:
+				reply += '\nFps: %g' % fps  # presentation rate for the client's playout clock
+			if rtcp_port is not None:
+				reply += '\nRtcp-Port: ' + str(rtcp_port)  # where receiver reports go
+			if fec is not None:
+				reply += '\nFec: ' + str(fec)  # FEC group size in use, 0 = none
+			if range_start is not None:
+				# where the stream restarts: play time, then first RTP seq/timestamp
+				first = self.clientInfo['videoStream'].frameNbr() + 1
+				reply += '\nRange: npt=%.3f-' % ((first - 1) * self.frameInterval())
+				reply += '\nRTP-Info: seq=%d;rtptime=%d' % (self.rtpSeq, self.rtpTimestamp(first))
+			if body is not None:
+				reply += '\nContent-Type: text/parameters\nContent-Length: %d\n\n%s' % (len(body), body)
+			self.sendRtspReply(reply)
 		
 		# Error messages
 		elif code == self.FILE_NOT_FOUND_404:
 			print("404 NOT FOUND")
 		elif code == self.CON_ERR_500:
 			print("500 CONNECTION ERROR")
+		elif code == self.INVALID_RANGE_457:
+			print("457 INVALID RANGE")
+			self.sendRtspReply('RTSP/1.0 457 Invalid Range\nCSeq: ' + seq + '\nSession: '
+							   + str(self.clientInfo.get('session', 0)))
+		elif code == self.METHOD_NOT_VALID_455:
+			print("455 METHOD NOT VALID IN THIS STATE")
+			self.sendRtspReply('RTSP/1.0 455 Method Not Valid in This State\nCSeq: ' + seq
+							   + '\nSession: ' + str(self.clientInfo.get('session', 0)))
+
+	def sendRtspReply(self, reply):
+		"""Write a reply on the RTSP connection."""
+		connSocket = self.clientInfo['rtspSocket'][0]
+		connSocket.send(reply.encode())
 
 	def downscale_frame(self, frame_bytes):
 		"""Downscale JPEG frame to reduce size before sending."""
@@ -1,62 +1,73 @@
 # VideoStream.py
+import mmap
+import os
+import sys
+import struct
+from array import array
+
+# Sidecar index stored next to the video: "<video>.idx"
+INDEX_SUFFIX = ".idx"
+INDEX_MAGIC = b"VSIX"
+INDEX_VERSION = 1
+# magic, version, mode, file size, file mtime (ns), frame count
+_INDEX_HEADER = struct.Struct("<4sHB1xQqI")
+_MODES = {"normal": 0, "hd": 1}
+
+
 class VideoStream:
-    def __init__(self, filename, mode="normal"):
+    def __init__(self, filename, mode="normal", cache=None):
         self.filename = filename
         self.file = open(filename, 'rb') # open file in  read binary mode
         self.frameNum = 0
         self.mode = mode  # "normal" or "hd"
-        self.totalFrames = self._count_frames()
+        # Optional FrameCache shared with other sessions streaming the same file
+        self.cache = cache
+        self.cacheKey = (os.path.realpath(filename), mode,
+                         os.fstat(self.file.fileno()).st_mtime_ns)
+        # Frames are served as memoryview slices of a read-only mapping
+        self._map = self._open_map()
+        self._view = memoryview(self._map if self._map is not None else b'')
+        # offsets[i] / lengths[i] locate the payload of frame i + 1
+        self.offsets, self.lengths = self._load_index()
+        self.totalFrames = len(self.offsets)
 
     def frameNbr(self):
         """Return current frame number."""
         return self.frameNum
 
     # ==========================
-    # NORMAL MODE (lab format)
+    # RANDOM ACCESS
     # ==========================
-    def nextFrame_normal(self):
-        """Read frame in 5-byte-length format."""
-        header = self.file.read(5)
-        if len(header) < 5:
-            return None
-        
-        try:
-            frameLength = int(header)
-        except:
+    def frameAt(self, n):
+        """Return frame n (1-based) without moving the stream position.
+
+        Without a cache this is a zero-copy memoryview of the mapping; with a
+        shared cache, misses are copied out once and served from memory."""
+        if n < 1 or n > self.totalFrames:
             return None
+        offset = self.offsets[n - 1]
+        if self.cache is None:
+            return self._view[offset:offset + self.lengths[n - 1]]
 
-        data = self.file.read(frameLength)
+        key = (self.cacheKey, n)
+        data = self.cache.get(key)
+        if data is None:
+            data = self._map[offset:offset + self.lengths[n - 1]]
+            self.cache.put(key, data)
         return data
 
-    # ==========================
-    # HD MODE (JPEG scanning)
-    # ==========================
-    def nextFrame_hd(self):
-        """Read JPEG frame bounded by FF D8 ... FF D9."""
-        # 1. find start marker FF D8
-        while True:
-            b = self.file.read(1)
-            if not b:
-                return None  # end of file
-
-            if b == b'\xff':
-                n = self.file.read(1)
-                if n == b'\xd8':
-                    frame = b'\xff\xd8'
-                    break
-
-        # 2. read until end marker FF D9
-        while True:
-            byte = self.file.read(1)
-            if not byte:
-                return None
-
-            frame += byte
-
-            if byte == b'\xd9' and frame[-2] == 0xFF:
-                break
+    def frameView(self, n):
+        """Frame n as a zero-copy view of the mapping, bypassing the cache:
+        for callers that keep their own derived copy (HD packet store)."""
+        if n < 1 or n > self.totalFrames:
+            return None
+        offset = self.offsets[n - 1]
+        return self._view[offset:offset + self.lengths[n - 1]]
 
-        return frame
+    def seek(self, n):
+        """Position the stream so the next nextFrame() returns frame n (1-based)."""
+        n = max(1, min(n, self.totalFrames + 1))
+        self.frameNum = n - 1
 
     # ==========================
     # MODE SELECTOR
@@ -65,59 +76,110 @@ class VideoStream:
         if self.frameNum >= self.totalFrames:
             return None
         self.frameNum += 1
+        return self.frameAt(self.frameNum)
 
-        if self.mode == "hd":
-            return self.nextFrame_hd()
-        else:
-            return self.nextFrame_normal()
+    def close(self):
+        self._view.release()
+        if self._map is not None:
+            try:
+                self._map.close()
+            except BufferError:
+                pass  # frames still referenced elsewhere; freed with them
+        self.file.close()
+
+    def _open_map(self):
+        if os.fstat(self.file.fileno()).st_size == 0:
+            return None  # empty files cannot be mapped
+        return mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
 
     # ==========================
-    # FRAME COUNTING
+    # FRAME INDEX
     # ==========================
-    def _count_frames(self):
-        """Count total frames in file without disturbing main stream pointer."""
+    def _index_path(self):
+        return self.filename + INDEX_SUFFIX
+
+    def _load_index(self):
+        """Load the sidecar index if it matches the video, otherwise rebuild it."""
+        st = os.fstat(self.file.fileno())
+        index = self._read_index(st)
+        if index is not None:
+            return index
+
+        offsets, lengths = array('Q'), array('I')
+        if self._map is None:
+            return offsets, lengths
+        if self.mode == "hd":
+            self._index_hd_frames(self._map, offsets, lengths)
+        else:
+            self._index_normal_frames(self._map, offsets, lengths)
+
+        self._write_index(st, offsets, lengths)
+        return offsets, lengths
+
+    def _read_index(self, st):
         try:
-            with open(self.filename, 'rb') as f:
-                if self.mode == "hd":
-                    return self._count_hd_frames(f)
-                else:
-                    return self._count_normal_frames(f)
-        except Exception:
-            return 0
-
-    def _count_normal_frames(self, fh):
-        count = 0
-        while True:
-            header = fh.read(5)
-            if len(header) < 5:
-                break
+            with open(self._index_path(), 'rb') as f:
+                header = f.read(_INDEX_HEADER.size)
+                magic, version, mode, size, mtime, count = _INDEX_HEADER.unpack(header)
+                if (magic != INDEX_MAGIC or version != INDEX_VERSION
+                        or mode != _MODES[self.mode]
+                        or size != st.st_size or mtime != st.st_mtime_ns):
+                    return None
+                offsets, lengths = array('Q'), array('I')
+                offsets.fromfile(f, count)
+                lengths.fromfile(f, count)
+        except (OSError, EOFError, struct.error):
+            return None
+        if sys.byteorder == "big":
+            offsets.byteswap()
+            lengths.byteswap()
+        return offsets, lengths
+
+    def _write_index(self, st, offsets, lengths):
+        """Persist the index atomically; a read-only media dir just means no sidecar."""
+        path = self._index_path()
+        tmp = "%s.%d.tmp" % (path, os.getpid())  # prefork workers may index concurrently
+        header = _INDEX_HEADER.pack(INDEX_MAGIC, INDEX_VERSION, _MODES[self.mode],
+                                    st.st_size, st.st_mtime_ns, len(offsets))
+        if sys.byteorder == "big":
+            offsets, lengths = array('Q', offsets), array('I', lengths)
+            offsets.byteswap()
+            lengths.byteswap()
+        try:
+            with open(tmp, 'wb') as f:
+                f.write(header)
+                offsets.tofile(f)
+                lengths.tofile(f)
+            os.replace(tmp, path)
+        except OSError as exc:
+            print("Cannot write frame index:", exc)
+
+    def _index_normal_frames(self, buf, offsets, lengths):
+        """Lab format: 5-byte ASCII length header followed by the frame."""
+        pos, end = 0, len(buf)
+        while pos + 5 <= end:
             try:
-                frameLength = int(header)
-            except:
+                frameLength = int(buf[pos:pos + 5])
+            except ValueError:
                 break
-            data = fh.read(frameLength)
-            if len(data) < frameLength:
+            if pos + 5 + frameLength > end:
                 break
-            count += 1
-        return count
+            offsets.append(pos + 5)
+            lengths.append(frameLength)
+            pos += 5 + frameLength
 
-    def _count_hd_frames(self, fh):
-        count = 0
+    def _index_hd_frames(self, buf, offsets, lengths):
+        """HD format: raw JPEGs bounded by FF D8 ... FF D9, located with
+        find() over the whole mapping instead of byte-by-byte reads."""
+        pos = 0
         while True:
-            b = fh.read(1)
-            if not b:
+            start = buf.find(b'\xff\xd8', pos)
+            if start < 0:
+                break
+            end = buf.find(b'\xff\xd9', start + 2)
+            if end < 0:
                 break
-            if b == b'\xff':
-                n = fh.read(1)
-                if n == b'\xd8':
-                    # scan to end marker
-                    prev = b'\xff'
-                    while True:
-                        c = fh.read(1)
-                        if not c:
-                            return count
-                        if c == b'\xd9' and prev == b'\xff':
-                            count += 1
-                            break
-                        prev = c
-        return count
+            end += 2
+            offsets.append(start)
+            lengths.append(end - start)
+            pos = end
@@ -0,0 +1,65 @@
+# abr.py
+
+
+class AbrController:
+    """
+    Rendition choice for one session from the client's feedback.
+
+    `bitrates` are the ladder's (file-average) bitrates in bit/s, best
+    first. A report with loss above DOWN_LOSS steps down one rendition;
+    one whose throughput is clearly below what the server sent over the
+    same interval (the link is the limit) steps down right away to the
+    best rendition that throughput can carry. Throughput below the
+    average bitrate alone is not a signal: it is what quiet stretches of
+    content look like. Stepping up is cautious: only
+    after UP_HOLD clean reports in a row, one step at a time, and never
+    above the session's rate cap.
+    """
+
+    DOWN_LOSS = 0.05
+    UP_LOSS = 0.01
+    UP_HOLD = 3  # clean reports before stepping up
+    HEADROOM = 0.8  # use at most this share of the measured throughput
+
+    def __init__(self, bitrates, rateCap=0):
+        self.bitrates = bitrates
+        self.rateCap = rateCap  # bit/s, 0 = none
+        self.index = 0
+        self.clean = 0
+        self.switches = 0
+
+    def onFeedback(self, loss, throughput, sent=None, available=None):
+        """Return the rendition index to stream from now on.
+
+        sent is the bit/s the server sent over the report's interval (None
+        if unknown); available(index) tells whether a rendition can be
+        switched to yet."""
+        available = available or (lambda index: True)
+        target = self.index
+        congested = bool(sent) and throughput < sent * self.HEADROOM
+        if loss > self.DOWN_LOSS or congested:
+            self.clean = 0
+            target = min(self.index + 1, len(self.bitrates) - 1)
+            if congested:
+                budget = throughput * self.HEADROOM
+                while target < len(self.bitrates) - 1 and self.bitrates[target] > budget:
+                    target += 1
+        elif loss < self.UP_LOSS:
+            self.clean += 1
+            if self.clean >= self.UP_HOLD and self.index > 0:
+                up = self.bitrates[self.index - 1]
+                if not self.rateCap or up <= self.rateCap * self.HEADROOM:
+                    target = self.index - 1
+        else:
+            self.clean = 0
+
+        # renditions still being transcoded cannot be used: settle for the
+        # nearest ready one on the same side
+        step = 1 if target > self.index else -1
+        while target != self.index and not available(target):
+            target -= step
+        if target != self.index:
+            self.index = target
+            self.clean = 0
+            self.switches += 1
+        return self.index
@@ -0,0 +1,288 @@
+# async_server.py
+import asyncio
+import collections
+import heapq
+import itertools
+import socket
+
+from ServerWorker import ServerWorker
+from udp_batch import BatchSender
+
+
+class RtpProtocol(asyncio.DatagramProtocol):
+    """Single UDP endpoint that carries the RTP output of every session."""
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def error_received(self, exc):
+        print("Connection Error (RTP):", exc)
+
+
+class RtcpProtocol(asyncio.DatagramProtocol):
+    """Companion UDP port (RTSP port + 1) receiving every session's reports."""
+
+    def __init__(self, demux):
+        self.demux = demux
+
+    def datagram_received(self, data, addr):
+        self.demux.datagramReceived(data, addr)
+
+
+class FrameScheduler:
+    """
+    Shared pacing for all playing sessions: one timer heap, one task.
+    Each entry is (deadline, order, session, generation); entries whose
+    generation no longer matches the session (PAUSE/TEARDOWN) are dropped.
+    """
+
+    def __init__(self):
+        self.heap = []
+        self.order = itertools.count()
+        self.wakeup = asyncio.Event()
+
+    def add(self, session, when):
+        heapq.heappush(self.heap, (when, next(self.order), session, session.generation))
+        self.wakeup.set()
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            if not self.heap:
+                self.wakeup.clear()
+                await self.wakeup.wait()
+                continue
+
+            delay = self.heap[0][0] - loop.time()
+            if delay > 0:
+                # sleep until the earliest deadline or until a new session is added
+                self.wakeup.clear()
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            now = loop.time()
+            while self.heap and self.heap[0][0] <= now:
+                deadline, _, session, generation = heapq.heappop(self.heap)
+                if generation != session.generation:
+                    continue  # paused or torn down since it was scheduled
+                if not session.sendNextFrame(deadline):
+                    continue
+                interval = session.frameInterval()
+                # keep a drift-free cadence, but do not burst to catch up
+                nextDeadline = deadline + interval
+                if nextDeadline < now - interval:
+                    nextDeadline = now + interval
+                heapq.heappush(self.heap, (nextDeadline, next(self.order), session, generation))
+
+
+class AsyncSession(ServerWorker):
+    """
+    One RTSP session on the event loop. RTSP parsing and replies are
+    inherited from ServerWorker; only the transport hooks differ.
+    """
+
+    def __init__(self, clientInfo, frameCache, packetStore, pacing, renditions, rtcp, metrics,
+                 writer, rtp, scheduler):
+        super().__init__(clientInfo, frameCache, packetStore, pacing, renditions, rtcp, metrics)
+        self.writer = writer
+        self.rtp = rtp
+        self.scheduler = scheduler
+        self.pacer = None  # set by PLAY; NACKs can arrive before it
+        self.generation = 0
+        self.queued = collections.deque()  # (timer, batch) waiting for their paced slot
+        self.throttled = 0  # batches the token bucket is holding back
+
+    def sendRtspReply(self, reply):
+        self.writer.write(reply.encode())
+
+    def startStreaming(self):
+        self.generation += 1
+        self.queued.clear()
+        self.throttled = 0
+        self.pacer = self.pacing.newPacer()
+        print(">> Using HD scheduler" if self.isHD else ">> Using SD scheduler")
+        self.scheduler.add(self, asyncio.get_running_loop().time())
+
+    def stopStreaming(self):
+        self.generation += 1
+        for timer, _ in self.queued:
+            timer.cancel()
+        self.queued.clear()
+
+    def closeSession(self):
+        self.stopStreaming()
+        self.closeRtcp()
+        self.unregisterMetrics()
+        if 'videoStream' in self.clientInfo:
+            self.clientInfo['videoStream'].close()
+        if self.frameCache is not None:
+            print("[CACHE]", self.frameCache.stats())
+        if self.packetStore is not None:
+            print("[PACKET STORE]", self.packetStore.stats())
+
+    def sendRetransmit(self, packets):
+        if self.pacer is not None:
+            self.pacer.reserve(self.batchBytes(packets))
+        self.sessionMetrics.retransmitted += len(packets)
+        for parts, address in packets:
+            self.rtp.transport.sendto(b"".join(parts), address)
+
+    def sendNextFrame(self, deadline=None):
+        """Queue one frame's paced batches; return False once the stream has ended."""
+        if self.throttled:
+            return True  # rate limit held the last frame back: skip this tick
+        # slots of the last frame ran past this deadline (busy loop): send them now
+        while self.queued:
+            timer, batch = self.queued.popleft()
+            timer.cancel()
+            self.releaseBatch(self.generation, batch)
+        if self.throttled:
+            return True
+
+        loop = asyncio.get_running_loop()
+        metrics = self.sessionMetrics
+        started = loop.time()
+        if deadline is not None:
+            metrics.lateness.observe(max(0, started - deadline))
+        stream = self.clientInfo['videoStream']
+        if self.isHD:
+            packets = self.nextHdPackets()
+            ended = packets is None
+        else:
+            frame = stream.nextFrame()
+            ended = not frame
+        metrics.readLatency.observe(loop.time() - started)
+        if ended:
+            print("[SERVER] End of video reached. Stopping RTP stream.")
+            self.stopStreaming()
+            return False
+
+        if self.isHD:
+            batches = [packets[i:i + self.BATCH_PACKETS]
+                       for i in range(0, len(packets), self.BATCH_PACKETS)]
+        else:
+            address = self.clientInfo['rtspSocket'][1][0]
+            packet = self.makeRtp(frame, stream.frameNbr(), marker=1)
+            batches = [[((packet,), (address, self.clientInfo['rtpPort']))]]
+            packets = batches[0]
+
+        start = loop.time()
+        metrics.onFrame(len(packets), self.batchBytes(packets))
+        for n, batch in enumerate(batches):
+            when = self.pacer.slot(start, n, len(batches), self.frameInterval())
+            self.queued.append((loop.call_at(when, self.nextSlot, self.generation), batch))
+        return True
+
+    def nextSlot(self, generation):
+        # slots fire in order, so the oldest queued batch is the one due
+        if generation == self.generation and self.queued:
+            self.releaseBatch(generation, self.queued.popleft()[1])
+
+    def releaseBatch(self, generation, batch):
+        """Batch reached its slot in the frame: wait for tokens, then send."""
+        if generation != self.generation:
+            return
+        delay = self.pacer.reserve(self.batchBytes(batch))
+        if delay > 0:
+            self.throttled += 1
+            asyncio.get_running_loop().call_later(delay, self.transmit, generation, batch, True)
+        else:
+            self.transmit(generation, batch)
+
+    def transmit(self, generation, batch, throttled=False):
+        if generation != self.generation:
+            return
+        if throttled:
+            self.throttled -= 1
+        try:
+            started = asyncio.get_running_loop().time()
+            # socket buffer full: let the transport queue the rest
+            for parts, address in self.rtp.sender.send(batch):
+                self.rtp.transport.sendto(b"".join(parts), address)
+            self.sessionMetrics.sendLatency.observe(asyncio.get_running_loop().time() - started)
+        except Exception as exc:
+            print("Connection Error:", exc)
+
+
+class AsyncServer:
+    """RTSP control on asyncio streams, RTP on one DatagramProtocol."""
+
+    def __init__(self, port, frameCache=None, packetStore=None, pacing=None, renditions=None,
+                 rtcp=None, metrics=None, handoff=None, sock=None):
+        self.port = port
+        self.frameCache = frameCache
+        self.packetStore = packetStore
+        self.pacing = pacing
+        self.renditions = renditions
+        self.rtcp = rtcp
+        self.metrics = metrics
+        self.handoff = handoff  # prefork: move HD clients to a quieter worker
+        self.sock = sock  # prefork: this worker's SO_REUSEPORT listener
+
+    def run(self):
+        asyncio.run(self.serve())
+
+    async def serve(self):
+        loop = asyncio.get_running_loop()
+
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        try:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, 4 << 20)
+        except OSError as exc:
+            print("Cannot set SO_SNDBUF:", exc)
+        sock.bind(('', 0))
+        _, self.rtp = await loop.create_datagram_endpoint(RtpProtocol, sock=sock)
+        self.rtp.sender = BatchSender(sock)
+        print("[ASYNC] UDP send mode:", self.rtp.sender.mode)
+        if self.rtcp is not None:
+            await loop.create_datagram_endpoint(lambda: RtcpProtocol(self.rtcp),
+                                                local_addr=('0.0.0.0', self.rtcp.port))
+
+        self.scheduler = FrameScheduler()
+        schedulerTask = asyncio.create_task(self.scheduler.run())
+
+        if self.sock is not None:
+            server = await asyncio.start_server(self.handleClient, sock=self.sock)
+        else:
+            server = await asyncio.start_server(self.handleClient, '', self.port)
+        if self.handoff is not None:
+            self.handoff.listen(lambda sock, data: asyncio.run_coroutine_threadsafe(
+                self.adopt(sock, data), loop))
+        print("[ASYNC] Serving RTSP on port", self.port)
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            schedulerTask.cancel()
+
+    async def adopt(self, sock, data):
+        """Connection handed over by another prefork worker."""
+        reader, writer = await asyncio.open_connection(sock=sock)
+        await self.handleClient(reader, writer, data)
+
+    async def handleClient(self, reader, writer, data=None):
+        if data is None:
+            data = await reader.read(1024)
+            if data and self.handoff is not None and self.handoff.offer(
+                    writer.get_extra_info('socket'), data):
+                writer.close()
+                return  # another worker serves this client now
+        clientInfo = {'rtspSocket': (writer, writer.get_extra_info('peername'))}
+        session = AsyncSession(clientInfo, self.frameCache, self.packetStore, self.pacing,
+                               self.renditions, self.rtcp, self.metrics, writer, self.rtp,
+                               self.scheduler)
+        try:
+            while data:
+                print("Data received:\n" + data.decode("utf-8"))
+                session.processRtspData(data.decode("utf-8"))
+                await writer.drain()
+                data = await reader.read(1024)
+        except ConnectionError:
+            pass
+        finally:
+            if session.state != session.INIT:
+                session.closeSession()
+            writer.close()
@@ -0,0 +1,285 @@
+# bench_loopback.py
+"""
+End-to-end loopback benchmark: starts Server.py on synthetic movies and
+drives N headless RTSP/RTP clients (SD and HD) against it.
+
+Reports aggregate throughput, per-stream achieved fps, frame completion
+ratio, server CPU per stream and p50/p99 frame delivery latency (frame
+completed at the client vs. its slot on the nominal schedule started at
+PLAY). Results go to a JSON file so runs can be compared across commits.
+
+Usage: python bench_loopback.py [--sd N] [--hd N] [--frames N] [--engine thread|async]
+                                [--out results.json] [-- extra Server.py options]
+"""
+import argparse
+import json
+import os
+import resource
+import selectors
+import socket
+import subprocess
+import sys
+import tempfile
+from time import monotonic, perf_counter, process_time, sleep
+
+from RtpPacket import HEADER_SIZE, EXTENSION
+from bench_videostream import make_synthetic_mjpeg
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def percentile(values, q):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q / 100 * len(values)))]
+
+
+class Stream:
+    """One headless client: RTSP on TCP, RTP on port (and port + 2 for HD)."""
+
+    def __init__(self, name, server, rtpPort, hd):
+        self.name = name
+        self.hd = hd
+        self.cseq = 0
+        self.rtsp = socket.create_connection(server)
+        self.rtpSockets = []
+        for port in (rtpPort, rtpPort + 2) if hd else (rtpPort,):
+            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4 << 20)
+            sock.bind(("127.0.0.1", port))
+            sock.setblocking(False)
+            self.rtpSockets.append(sock)
+        self.rtpPort = rtpPort
+        self.partial = {}  # frame ID -> fragment indices received
+        self.latencies = []
+        self.completed = []  # completion times
+        self.packets = 0
+        self.bytes = 0
+        self.lastFrame = 0
+
+    def request(self, method, extra=""):
+        self.cseq += 1
+        self.rtsp.sendall(f"{method} movie.Mjpeg RTSP/1.0\nCSeq: {self.cseq}\n{extra}\n".encode())
+        reply = self.rtsp.recv(4096).decode()
+        headers = dict(line.split(": ", 1) for line in reply.splitlines()[1:] if ": " in line)
+        if not reply.startswith("RTSP/1.0 200"):
+            raise RuntimeError(f"{self.name}: {method} failed: {reply!r}")
+        return headers
+
+    def setup(self):
+        headers = self.request("SETUP", f"Transport: RTP/UDP; client_port= {self.rtpPort}\n"
+                                        + ("Prefer: HD\n" if self.hd else ""))
+        self.session = headers["Session"]
+        self.totalFrames = int(headers["Frames"])
+        self.interval = 1 / float(headers["Fps"])
+
+    def play(self):
+        self.playAt = monotonic()  # the server starts sending after this
+        self.request("PLAY", f"Session: {self.session}\n")
+
+    def teardown(self):
+        try:
+            self.request("TEARDOWN", f"Session: {self.session}\n")
+        except OSError:
+            pass
+        self.rtsp.close()
+        for sock in self.rtpSockets:
+            sock.close()
+
+    def onPacket(self, data, now):
+        self.packets += 1
+        self.bytes += len(data)
+        offset = HEADER_SIZE
+        frameId = None
+        if data[0] & 0x10:  # frame-ID header extension
+            frameId = EXTENSION.unpack_from(data, HEADER_SIZE)[2]
+            offset += EXTENSION.size
+        if not self.hd:
+            self.frameDone(frameId, now)
+            return
+        idx = int.from_bytes(data[offset:offset + 2], "big")
+        total = int.from_bytes(data[offset + 2:offset + 4], "big")
+        if idx & 0x8000:
+            return  # FEC parity (not negotiated by this client)
+        received = self.partial.setdefault(frameId, set())
+        received.add(idx)
+        if len(received) == total:
+            del self.partial[frameId]
+            self.frameDone(frameId, now)
+
+    def frameDone(self, frameId, now):
+        self.completed.append(now)
+        self.latencies.append(now - (self.playAt + (frameId - 1) * self.interval))
+        self.lastFrame = max(self.lastFrame, frameId)
+
+    def finished(self):
+        return self.lastFrame >= self.totalFrames
+
+    def result(self):
+        done = len(self.completed)
+        span = self.completed[-1] - self.completed[0] if done > 1 else 0
+        return {
+            "name": self.name,
+            "mode": "hd" if self.hd else "sd",
+            "target_fps": round(1 / self.interval, 2),
+            "fps": round((done - 1) / span, 2) if span else 0.0,
+            "frames": self.totalFrames,
+            "completed": done,
+            "completion_ratio": round(done / self.totalFrames, 4) if self.totalFrames else 0.0,
+            "packets": self.packets,
+            "bytes": self.bytes,
+            "latency_p50_ms": round(1e3 * percentile(self.latencies, 50), 2) if done else None,
+            "latency_p99_ms": round(1e3 * percentile(self.latencies, 99), 2) if done else None,
+        }
+
+
+def processCpu(pid):
+    """CPU seconds used so far by a child process (Linux /proc), or None."""
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+    except OSError:
+        return None
+    return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+
+
+def serverCpu(pid):
+    """processCpu of the server and its child processes (--workers)."""
+    total = processCpu(pid)
+    if total is None:
+        return None
+    try:
+        with open(f"/proc/{pid}/task/{pid}/children") as f:
+            children = [int(child) for child in f.read().split()]
+    except OSError:
+        children = []
+    return total + sum(processCpu(child) or 0.0 for child in children)
+
+
+def startServer(workdir, port, engine, extra):
+    server = subprocess.Popen(
+        [sys.executable, os.path.join(HERE, "Server.py"), str(port), "--engine", engine] + extra,
+        cwd=workdir, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    for _ in range(100):
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=0.1).close()
+            return server
+        except OSError:
+            if server.poll() is not None:
+                raise RuntimeError("Server.py exited with status %d" % server.returncode)
+            sleep(0.05)
+    server.kill()
+    raise RuntimeError("Server.py did not start listening")
+
+
+def receive(streams, deadline, idle=2.0):
+    """Read every RTP socket until all streams ended, nothing arrived for
+    `idle` seconds, or the deadline passed."""
+    selector = selectors.DefaultSelector()
+    for stream in streams:
+        for sock in stream.rtpSockets:
+            selector.register(sock, selectors.EVENT_READ, stream)
+    last = monotonic()
+    while not all(s.finished() for s in streams):
+        now = monotonic()
+        if now > deadline or now - last > idle:
+            break
+        for key, _ in selector.select(0.1):
+            while True:
+                try:
+                    data = key.fileobj.recv(65536)
+                except BlockingIOError:
+                    break
+                last = monotonic()
+                key.data.onPacket(data, last)
+    selector.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Loopback RTSP/RTP server benchmark")
+    parser.add_argument("--sd", type=int, default=4, help="SD streams")
+    parser.add_argument("--hd", type=int, default=2, help="HD streams")
+    parser.add_argument("--frames", type=int, default=250, help="frames per synthetic movie")
+    parser.add_argument("--sd-kb", type=int, default=20,
+                        help="SD frame size (lab format, sent as one datagram: < 63 KB)")
+    parser.add_argument("--hd-kb", type=int, default=150, help="HD frame size (raw SOI/EOI format)")
+    parser.add_argument("--engine", choices=("thread", "async"), default="thread")
+    parser.add_argument("--port", type=int, default=28554, help="RTSP port (RTCP uses port + 1)")
+    parser.add_argument("--rtp-base", type=int, default=30000, help="first client RTP port")
+    parser.add_argument("--out", default="bench_loopback.json", help="JSON results file")
+    parser.add_argument("server_args", nargs="*",
+                        help="extra Server.py options after --; default --no-abr "
+                             "(synthetic frames are not decodable)")
+    args = parser.parse_args()
+    extra = args.server_args or ["--no-abr"]
+
+    with tempfile.TemporaryDirectory() as workdir:
+        make_synthetic_mjpeg(os.path.join(workdir, "movie.Mjpeg"), args.frames,
+                             args.sd_kb * 1024, hd=False)
+        make_synthetic_mjpeg(os.path.join(workdir, "movie_HD.Mjpeg"), args.frames,
+                             args.hd_kb * 1024, hd=True)
+
+        cpuBefore = resource.getrusage(resource.RUSAGE_CHILDREN)
+        server = startServer(workdir, args.port, args.engine, extra)
+        streams = []
+        try:
+            for i in range(args.sd + args.hd):
+                hd = i >= args.sd
+                stream = Stream(f"{'hd' if hd else 'sd'}{i}", ("127.0.0.1", args.port),
+                                args.rtp_base + 4 * i, hd)
+                stream.setup()
+                streams.append(stream)
+
+            clientCpu, wall = process_time(), perf_counter()
+            cpu = serverCpu(server.pid)
+            for stream in streams:
+                stream.play()
+            longest = max(s.totalFrames * s.interval for s in streams)
+            receive(streams, monotonic() + 1.5 * longest + 5)
+            wall, clientCpu = perf_counter() - wall, process_time() - clientCpu
+            if cpu is not None:
+                cpu = serverCpu(server.pid) - cpu
+            for stream in streams:
+                stream.teardown()
+        finally:
+            server.terminate()
+            server.wait()
+        cpuAfter = resource.getrusage(resource.RUSAGE_CHILDREN)
+
+    if cpu is None:  # no /proc: whole server lifetime, startup included
+        cpu = (cpuAfter.ru_utime - cpuBefore.ru_utime) + (cpuAfter.ru_stime - cpuBefore.ru_stime)
+    results = [s.result() for s in streams]
+    latencies = [l for s in streams for l in s.latencies]
+    total = sum(r["bytes"] for r in results)
+    summary = {
+        "streams": len(streams),
+        "wall_s": round(wall, 3),
+        "throughput_mbps": round(total * 8 / wall / 1e6, 2),
+        "server_cpu_s": round(cpu, 3),
+        "server_cpu_per_stream_pct": round(100 * cpu / wall / len(streams), 2),
+        "client_cpu_s": round(clientCpu, 3),
+        "completion_ratio": round(sum(r["completed"] for r in results)
+                                  / sum(r["frames"] for r in results), 4),
+        "latency_p50_ms": round(1e3 * percentile(latencies, 50), 2) if latencies else None,
+        "latency_p99_ms": round(1e3 * percentile(latencies, 99), 2) if latencies else None,
+    }
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=HERE,
+                                capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        commit = None
+
+    print(f"{'stream':<6} {'fps':>7} {'target':>7} {'done':>7} {'p50 ms':>8} {'p99 ms':>8}")
+    for r in results:
+        print(f"{r['name']:<6} {r['fps']:>7.2f} {r['target_fps']:>7.2f} {r['completion_ratio']:>7.1%}"
+              f" {r['latency_p50_ms'] or 0:>8.2f} {r['latency_p99_ms'] or 0:>8.2f}")
+    print(json.dumps(summary))
+    with open(args.out, "w") as f:
+        json.dump({"commit": commit, "config": vars(args), "summary": summary, "streams": results},
+                  f, indent=2)
+    print("Results written to", args.out)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+# bench_rtp.py
+"""
+Encode/decode throughput of the RTP codec: the original byte-by-byte
+implementation vs. RtpPacket (struct) vs. the allocation-free helpers.
+
+Usage: python bench_rtp.py [iterations]
+"""
+import sys
+from time import time
+from timeit import timeit
+
+from RtpPacket import RtpPacket, HEADER_SIZE, writeHeader, readHeader
+
+PAYLOAD = bytes(1204)  # idx/total prefix + one 1200-byte HD fragment
+
+
+def legacy_encode(seqnum, marker, ssrc, payload):
+    """The original RtpPacket.encode + getPacket."""
+    timestamp = int(time())
+    header = bytearray(HEADER_SIZE)
+    header[0] = (2 << 6)
+    header[1] = (marker << 7) | 26
+    header[2] = (seqnum >> 8) & 0xFF
+    header[3] = seqnum & 0xFF
+    header[4] = (timestamp >> 24) & 0xFF
+    header[5] = (timestamp >> 16) & 0xFF
+    header[6] = (timestamp >> 8) & 0xFF
+    header[7] = timestamp & 0xFF
+    header[8] = (ssrc >> 24) & 0xFF
+    header[9] = (ssrc >> 16) & 0xFF
+    header[10] = (ssrc >> 8) & 0xFF
+    header[11] = ssrc & 0xFF
+    return header + payload
+
+
+def legacy_decode(data):
+    """The original RtpPacket.decode + seqNum/marker/getPayload."""
+    header = bytearray(data[:HEADER_SIZE])
+    payload = data[HEADER_SIZE:]
+    return header[2] << 8 | header[3], (header[1] >> 7) & 0x01, payload
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    packet = legacy_encode(1, 1, 0, PAYLOAD)
+    headerBuf = bytearray(HEADER_SIZE)
+    rtp = RtpPacket()
+
+    def packet_encode():
+        rtp.encode(2, 0, 0, 0, 1, 1, 26, 0, PAYLOAD, timestamp=0)
+        return rtp.getPacket()
+
+    def packet_decode():
+        rtp.decode(packet)
+        return rtp.seqNum(), rtp.marker(), rtp.getPayload()
+
+    cases = [
+        ("encode legacy", lambda: legacy_encode(1, 1, 0, PAYLOAD)),
+        ("encode RtpPacket", packet_encode),
+        ("encode writeHeader", lambda: writeHeader(headerBuf, 0, 1, 0, 0, 1)),
+        ("decode legacy", lambda: legacy_decode(packet)),
+        ("decode RtpPacket", packet_decode),
+        ("decode readHeader", lambda: readHeader(packet)),
+    ]
+    for label, fn in cases:
+        elapsed = timeit(fn, number=n)
+        print(f"{label:<20} {n / elapsed / 1e6:7.2f} M ops/s  {elapsed / n * 1e9:8.0f} ns/op")
+
+
+if __name__ == "__main__":
+    main()
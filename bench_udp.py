@@ -0,0 +1,65 @@
+# bench_udp.py
+"""
+Benchmark HD fragment transmission: packets/s per CPU core for each
+BatchSender mode, over loopback to a sink socket that is never read.
+
+Usage: python bench_udp.py [frames] [frame_kb]
+"""
+import os
+import socket
+import sys
+from time import perf_counter, process_time
+
+from packet_store import fragmentFrame
+from udp_batch import BatchSender
+
+MAX_RTP_PAYLOAD = 1200
+BATCH_PACKETS = 16
+
+
+def fragment(frame, header, ports):
+    """Same packets as ServerWorker.nextHdPackets: (header, stored payload)."""
+    return [((header, payload), ports[idx % 2])
+            for idx, payload in enumerate(fragmentFrame(frame, MAX_RTP_PAYLOAD))]
+
+
+def run(mode, frame, frames, sinks):
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, 1 << 20)
+    sender = BatchSender(sock, mode)
+    packets = fragment(frame, bytes(12), [s.getsockname() for s in sinks])
+
+    wall, cpu = perf_counter(), process_time()
+    for _ in range(frames):
+        for i in range(0, len(packets), BATCH_PACKETS):
+            sender.send(packets[i:i + BATCH_PACKETS])
+    wall, cpu = perf_counter() - wall, process_time() - cpu
+    sock.close()
+
+    count = frames * len(packets)
+    print(f"{mode:<9} {count:>8} pkts  {count / wall:>10.0f} pkts/s  "
+          f"{count / cpu:>10.0f} pkts/cpu-s  {count * len(frame) / len(packets) / wall / 1e6:7.1f} MB/s")
+
+
+def main():
+    frames = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    frame_kb = int(sys.argv[2]) if len(sys.argv) > 2 else 300
+    frame = os.urandom(frame_kb * 1024)
+
+    sinks = []
+    for _ in range(2):
+        sink = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sink.bind(("127.0.0.1", 0))
+        sinks.append(sink)
+
+    print(f"{frames} frames x {frame_kb} KB, {MAX_RTP_PAYLOAD}-byte fragments, "
+          f"batches of {BATCH_PACKETS}")
+    for mode in BatchSender.MODES:
+        try:
+            run(mode, frame, frames, sinks)
+        except OSError as exc:
+            print(f"{mode:<9} unavailable: {exc}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+# bench_videostream.py
+"""
+Microbenchmark: legacy byte-by-byte HD reader vs. the mmap/find read path.
+
+Usage: python bench_videostream.py [frames] [frame_kb]
+"""
+import os
+import random
+import sys
+import tempfile
+from time import perf_counter
+
+from VideoStream import VideoStream, INDEX_SUFFIX
+
+
+def make_synthetic_mjpeg(path, frames, frame_size, hd=True):
+    """Write `frames` fake JPEGs (SOI + noise + EOI) of about `frame_size` bytes.
+
+    hd=True writes the raw SOI/EOI format, otherwise the lab format with a
+    5-byte length header (frame_size must then stay below 100000)."""
+    rng = random.Random(1234)
+    # noise without 0xFF so no marker appears inside a frame
+    noise = bytes(rng.randrange(0, 0xFF) for _ in range(frame_size))
+    with open(path, 'wb') as f:
+        for i in range(frames):
+            cut = rng.randrange(0, frame_size // 8 + 1)
+            frame = b'\xff\xd8' + noise[cut:] + noise[:cut] + b'\xff\xd9'
+            if not hd:
+                f.write(b'%05d' % len(frame))
+            f.write(frame)
+
+
+def legacy_read_all(path):
+    """The pre-mmap HD reader: one read(1) call and one bytes concat per byte."""
+    count = 0
+    with open(path, 'rb') as fh:
+        while True:
+            b = fh.read(1)
+            if not b:
+                return count
+            if b != b'\xff' or fh.read(1) != b'\xd8':
+                continue
+            frame = b'\xff\xd8'
+            while True:
+                byte = fh.read(1)
+                if not byte:
+                    return count
+                frame += byte
+                if byte == b'\xd9' and frame[-2] == 0xFF:
+                    break
+            count += 1
+
+
+def mmap_read_all(path):
+    """Cold start: index build over the mapping, then zero-copy frame slices."""
+    if os.path.exists(path + INDEX_SUFFIX):
+        os.remove(path + INDEX_SUFFIX)
+    stream = VideoStream(path, mode="hd")
+    count = 0
+    while stream.nextFrame() is not None:
+        count += 1
+    stream.close()
+    return count
+
+
+def run(label, fn, path, size):
+    start = perf_counter()
+    count = fn(path)
+    elapsed = perf_counter() - start
+    print(f"{label:<8} {count:>5} frames  {elapsed:8.3f} s  "
+          f"{count / elapsed:10.1f} fps  {size / elapsed / 1e6:9.1f} MB/s")
+    return elapsed
+
+
+def main():
+    frames = int(sys.argv[1]) if len(sys.argv) > 1 else 5  # legacy path is quadratic
+    # a 1080p MJPEG frame is typically 200-400 KB
+    frame_kb = int(sys.argv[2]) if len(sys.argv) > 2 else 300
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "synthetic_1080p.Mjpeg")
+        make_synthetic_mjpeg(path, frames, frame_kb * 1024)
+        size = os.path.getsize(path)
+        print(f"{frames} frames x {frame_kb} KB ({size / 1e6:.1f} MB)")
+
+        legacy = run("legacy", legacy_read_all, path, size)
+        fast = run("mmap", mmap_read_all, path, size)
+        print(f"speedup: {legacy / fast:.0f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,36 +1,131 @@
 # cache_manager.py
-import queue
+import threading
+
 
 class CacheManager:
     """
-    Quản lý cache frame (queue).
-    Có thể thay đổi thuật toán drop rất dễ dàng.
+    Playout buffer: frames indexed by frame number in a fixed ring.
+
+    - push_frame() stores a frame at slot frameNum % max_size, so frames
+      arriving out of order (striped ports) are played in frame order.
+    - pop_frame() returns the frame at the playhead. A missing frame is
+      waited for until a frame more than `reorder_window` ahead has arrived
+      (or the stream's last frame is in), then it is skipped.
+    - The buffer is bounded by frame count (ring size) and by bytes; when
+      over budget the frame furthest from the playhead is evicted.
     """
 
-    def __init__(self, max_size=200):
-        self.queue = queue.Queue(maxsize=max_size)
+    def __init__(self, max_size=200, max_bytes=256 * 1024 * 1024, reorder_window=8):
+        self.capacity = max_size
+        self.max_bytes = max_bytes
+        self.reorder_window = reorder_window
+        self.slots = [None] * max_size  # (frameNum, frameData) or None
+        self.lock = threading.Lock()
+        self.lastFrame = None  # total frames of the stream, once known
+        self._reset()
+
+        # counters
+        self.skipped = 0  # missing frames played past
+        self.late = 0  # frames that arrived after the playhead passed them
+        self.evicted = 0  # frames dropped for the frame/byte budget
+
+    def _reset(self):
+        for i in range(self.capacity):
+            self.slots[i] = None
+        self.next = None  # playhead: frame number popped next
+        self.started = False
+        self.count = 0
+        self.nbytes = 0
+        self.highest = 0
 
     def push_frame(self, frameNum, frameData):
-        """Thêm frame vào cache. Drop nếu đầy."""
-        if self.queue.full():
-            try:
-                self.queue.get_nowait()
-            except queue.Full:
+        """Thêm frame vào cache (ordered by frame number)."""
+        with self.lock:
+            if self.next is None or (not self.started and frameNum < self.next
+                                     and self.highest - frameNum < self.capacity):
+                # before playback starts the playhead follows the earliest frame
+                self.next = frameNum
+            if frameNum < self.next:
+                self.late += 1
+                return
+            if frameNum >= self.next + self.capacity:
                 print(f"[CACHE] Full → Drop frame {frameNum}")
-        try:
-            self.queue.put_nowait((frameNum, frameData))
-        except queue.Full:
-            pass
+                self.evicted += 1
+                return
+
+            i = frameNum % self.capacity
+            old = self.slots[i]
+            if old is not None:
+                self.nbytes -= len(old[1])
+                self.count -= 1
+            self.slots[i] = (frameNum, frameData)
+            self.count += 1
+            self.nbytes += len(frameData)
+            if frameNum > self.highest:
+                self.highest = frameNum
+
+            # over the byte budget: the furthest-ahead frame is the least useful
+            while self.nbytes > self.max_bytes and self.count > 1:
+                self._evict_highest()
+
+    def _evict_highest(self):
+        i = self.highest % self.capacity
+        frameNum, frameData = self.slots[i]
+        self.slots[i] = None
+        self.count -= 1
+        self.nbytes -= len(frameData)
+        self.evicted += 1
+        # next highest buffered frame
+        n = frameNum - 1
+        while n >= self.next and self.slots[n % self.capacity] is None:
+            n -= 1
+        self.highest = n
+
     def pop_frame(self):
-        """Lấy 1 frame để render. Nếu không có thì trả None."""
-        if self.queue.empty():
-            return None
-        return self.queue.get()
+        """Lấy frame tại playhead để render. Nếu chưa có thì trả None."""
+        with self.lock:
+            if self.count == 0:
+                return None
+            slot = self.slots[self.next % self.capacity]
+            if slot is None:
+                ended = self.lastFrame is not None and self.highest >= self.lastFrame
+                if self.highest - self.next <= self.reorder_window and not ended:
+                    return None  # still within the reorder window: wait
+                while self.slots[self.next % self.capacity] is None:
+                    self.next += 1
+                    self.skipped += 1
+                slot = self.slots[self.next % self.capacity]
+
+            self.slots[self.next % self.capacity] = None
+            self.count -= 1
+            self.nbytes -= len(slot[1])
+            self.next += 1
+            self.started = True
+            return slot
 
     def size(self):
-        return self.queue.qsize()
+        """Buffered frames."""
+        return self.count
+
+    def bytes(self):
+        """Buffered bytes."""
+        return self.nbytes
+
+    def full(self):
+        return self.count >= self.capacity or self.nbytes >= self.max_bytes
 
     def clear(self):
-        while not self.queue.empty():
-            self.queue.get()
-    
+        with self.lock:
+            self._reset()
+
+    def stats(self):
+        with self.lock:
+            return {
+                "frames": self.count,
+                "bytes": self.nbytes,
+                "playhead": self.next,
+                "highest": self.highest,
+                "skipped": self.skipped,
+                "late": self.late,
+                "evicted": self.evicted,
+            }
@@ -0,0 +1,107 @@
+# decode_pipeline.py
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from time import perf_counter
+
+
+class DecodePipeline:
+    """
+    Decode stage between the playout buffer (CacheManager) and the Tk loop.
+
+    fill() pops frames from the playout buffer in order and hands them to a
+    small worker pool, which decodes and scales them with Renderer.decode()
+    (PIL releases the GIL while decoding). At most `lookahead` frames are
+    popped but not yet shown: that is the backpressure, further frames wait
+    in the playout buffer, which drops new ones once it is full.
+    next_frame() is the only call the Tk loop needs; it never blocks.
+    With a PlayoutScheduler, frames that are already late are skipped
+    here, before any time is spent decoding them.
+    """
+
+    def __init__(self, cache, renderer, workers=2, lookahead=4, scheduler=None):
+        self.cache = cache
+        self.renderer = renderer
+        self.scheduler = scheduler
+        self.lookahead = lookahead
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="decode")
+        self.pending = deque()  # (frameNum, future), in frame order
+        self.lock = threading.Lock()
+
+        # metrics, decode time in seconds
+        self.decoded = 0
+        self.failed = 0
+        self.stalls = 0  # ticks where the next frame was still decoding
+        self.decodeTotal = 0.0
+        self.decodeMax = 0.0
+        self.decodeLast = 0.0
+
+    def _decode(self, frameData):
+        start = perf_counter()
+        img = self.renderer.decode(frameData)
+        elapsed = perf_counter() - start
+        with self.lock:
+            self.decoded += 1
+            self.decodeTotal += elapsed
+            self.decodeLast = elapsed
+            if elapsed > self.decodeMax:
+                self.decodeMax = elapsed
+        return img
+
+    def fill(self):
+        """Top up the decode queue from the playout buffer."""
+        with self.lock:
+            while len(self.pending) < self.lookahead:
+                item = self.cache.pop_frame()
+                if item is None:
+                    break
+                frameNum, frameData = item
+                if (self.scheduler is not None and self.scheduler.isLate(frameNum)
+                        and self.cache.size() > 0):
+                    # late and something newer is waiting: never decode it
+                    self.scheduler.skip(frameNum)
+                    continue
+                self.pending.append((frameNum, self.pool.submit(self._decode, frameData)))
+
+    def next_frame(self):
+        """(frameNum, image) for the next frame if it is decoded, else None."""
+        with self.lock:
+            while self.pending:
+                frameNum, future = self.pending[0]
+                if not future.done():
+                    self.stalls += 1
+                    return None
+                self.pending.popleft()
+                try:
+                    return frameNum, future.result()
+                except Exception as e:
+                    print(f"[Decode Error] frame {frameNum}:", e)
+                    self.failed += 1
+            return None
+
+    def size(self):
+        """Frames popped from the playout buffer but not shown yet."""
+        return len(self.pending)
+
+    def reset(self):
+        """Forget queued frames (seek / teardown)."""
+        with self.lock:
+            for _, future in self.pending:
+                future.cancel()
+            self.pending.clear()
+
+    def stop(self):
+        self.reset()
+        self.pool.shutdown(wait=False, cancel_futures=True)
+
+    def stats(self):
+        with self.lock:
+            return {
+                "decoded": self.decoded,
+                "failed": self.failed,
+                "queued": len(self.pending),
+                "stalls": self.stalls,
+                "decode_avg_ms": 1e3 * self.decodeTotal / self.decoded if self.decoded else 0.0,
+                "decode_max_ms": 1e3 * self.decodeMax,
+                "decode_last_ms": 1e3 * self.decodeLast,
+            }
@@ -0,0 +1,48 @@
+# fec.py
+"""
+XOR forward error correction for fragmented HD frames.
+
+Every group of K fragments of a frame is followed by one parity payload:
+    idx (2, PARITY_FLAG | group) + total (2) + XOR of the K chunk lengths (2)
+    + XOR of the K chunks, each zero-padded to the fragment size.
+Any single missing fragment of a group is the XOR of the parity with the
+other K - 1 chunks. The overhead is 1/K.
+"""
+
+PARITY_FLAG = 0x8000
+
+
+def xorChunks(chunks, size):
+    """XOR of byte strings, each zero-padded to `size`, as an int (big-endian)."""
+    acc = 0
+    for chunk in chunks:
+        acc ^= int.from_bytes(chunk, "big") << (8 * (size - len(chunk)))
+    return acc
+
+
+def addParity(fragments, group, size):
+    """Fragments from fragmentFrame() with a parity payload after each group."""
+    if group <= 0 or not fragments:
+        return fragments
+    total = fragments[0][2:4]
+    out = []
+    for g, start in enumerate(range(0, len(fragments), group)):
+        members = fragments[start:start + group]
+        chunks = [f[4:] for f in members]
+        lengthXor = 0
+        for chunk in chunks:
+            lengthXor ^= len(chunk)
+        out.extend(members)
+        out.append((PARITY_FLAG | g).to_bytes(2, "big") + total + lengthXor.to_bytes(2, "big")
+                   + xorChunks(chunks, size).to_bytes(size, "big"))
+    return out
+
+
+def recoverChunk(parity, chunks, size):
+    """Missing chunk of a group from its parity payload (without the 4-byte
+    idx/total prefix) and the group's other chunks."""
+    lengthXor = int.from_bytes(parity[:2], "big")
+    for chunk in chunks:
+        lengthXor ^= len(chunk)
+    data = (int.from_bytes(parity[2:], "big") ^ xorChunks(chunks, size)).to_bytes(size, "big")
+    return data[:lengthXor]
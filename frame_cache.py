@@ -0,0 +1,67 @@
+# frame_cache.py
+import threading
+from collections import OrderedDict
+
+
+class FrameCache:
+    """
+    Process-wide LRU cache of video frames shared by every session.
+    Key = (file, frame number); size is bounded by a byte budget.
+    """
+
+    def __init__(self, max_bytes=256 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.frames = OrderedDict()  # key -> (data, size), oldest first
+        self.bytes = 0
+        self.lock = threading.Lock()
+
+        # counters
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        """Return the cached frame or None (and count a miss)."""
+        with self.lock:
+            entry = self.frames.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.frames.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, data, size=None):
+        """Insert a frame, evicting least recently used ones to fit the budget."""
+        if size is None:
+            size = len(data)
+        if size > self.max_bytes:
+            return
+        with self.lock:
+            old = self.frames.pop(key, None)
+            if old is not None:
+                self.bytes -= old[1]
+            self.frames[key] = (data, size)
+            self.bytes += size
+            while self.bytes > self.max_bytes:
+                _, (_, evictedSize) = self.frames.popitem(last=False)
+                self.bytes -= evictedSize
+                self.evictions += 1
+
+    def clear(self):
+        with self.lock:
+            self.frames.clear()
+            self.bytes = 0
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "frames": len(self.frames),
+                "bytes": self.bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_ratio": self.hits / lookups if lookups else 0.0,
+            }
@@ -1,59 +1,245 @@
 # hd_handler.py
-import threading
+from time import monotonic
+
+from fec import PARITY_FLAG, recoverChunk
+
+
+class FrameSlot:
+    """Một frame HD đang ghép: one preallocated buffer, chunks written in place."""
+
+    __slots__ = ("buffer", "view", "total", "received", "bitmap", "size", "born", "last",
+                 "parity", "nacks")
+
+    def __init__(self, total, chunk_size):
+        self.buffer = bytearray(total * chunk_size)
+        self.view = memoryview(self.buffer)
+        self.total = total
+        self.received = 0
+        self.bitmap = bytearray(total)  # 1 = chunk idx arrived
+        self.size = len(self.buffer)  # trimmed once the last chunk arrives
+        self.born = self.last = monotonic()  # first / latest chunk arrival
+        self.parity = {}  # FEC group -> parity payload (without idx/total)
+        self.nacks = 0  # retransmission requests sent for this frame
+
 
 class HDHandler:
     """
     Xử lý ghép frame HD (nhiều chunk RTP).
-    Dùng từ Client.listenRtp().
+    Dùng từ Client.handleRtpPacket() on the single RtpReceiver thread, so
+    it takes no locks.
+
+    Each in-flight frame gets one buffer sized total * chunk_size; every
+    chunk is copied straight to idx * chunk_size and the finished frame is
+    returned as a memoryview of that buffer (no joins, no extra copies).
+    Incomplete frames are evicted once they are older than max_age seconds
+    or more than `window` frames behind the newest one. With FEC (fec_group
+    = K negotiated at SETUP) one lost chunk per group of K is rebuilt from
+    the group's parity packet (see fec.py) once the frame is settled: at
+    least repair_lag frames behind the newest, or no chunk for `grace`
+    seconds (repair_settled() checks the newest frames from a timer). The
+    other port's chunks of a frame are often still queued when the next
+    frame begins.
+    Whatever FEC cannot repair is queued for a NACK (take_nacks()), up to
+    nack_retries times per frame and only when at most nack_max chunks
+    are missing; the resent chunks then complete the frame as usual.
     """
 
-    def __init__(self):
-        # frameParts[frameNum] = { "total": int, "chunks": {idx: bytes} }
+    def __init__(self, chunk_size=1200, max_age=1.0, window=32, fec_group=0,
+                 nack_retries=0, nack_max=64, repair_lag=2, grace=0.02):
+        # frameParts[frameNum] = FrameSlot
         self.frameParts = {}
-        self.lock = threading.Lock()
+        self.chunk_size = chunk_size  # must match ServerWorker.MAX_RTP_PAYLOAD
+        self.max_age = max_age
+        self.window = window
+        self.fec_group = fec_group
+        self.nack_retries = nack_retries
+        self.nack_max = nack_max
+        self.repair_lag = repair_lag
+        self.grace = grace  # about one frame interval (set from the stream's fps)
+        self.newest = 0
+        self.finished = set()  # recently completed/dropped IDs, to ignore late duplicates
+        self.latency = 0.0  # first chunk -> complete, for the last finished frame
+        self.repaired = False  # ... and whether it took a NACK round trip
+
+        # counters
+        self.completed = 0
+        self.dropped = 0  # inconsistent or invalid frames
+        self.evicted = 0  # incomplete frames given up on
+        self.recovered = 0  # chunks rebuilt from FEC parity
+        self.ready = []  # frames completed by repair_older()
+        self.nacks = []  # (frameNum, missing chunk indices) to request again
+        self.nacked = 0  # chunks requested
 
     def reset(self):
         self.frameParts.clear()
+        self.ready.clear()
+        self.nacks.clear()
+        self.finished.clear()
+        self.newest = 0
+
+    def stats(self):
+        return {
+            "completed": self.completed,
+            "dropped": self.dropped,
+            "evicted": self.evicted,
+            "recovered": self.recovered,
+            "nacked": self.nacked,
+            "in_flight": len(self.frameParts),
+        }
 
     @staticmethod
     def is_valid_jpeg(data: bytes) -> bool:
         return len(data) >= 4 and data[:2] == b'\xff\xd8' and data[-2:] == b'\xff\xd9'
 
     def handle_hd_payload(self, frameNum, payload, markerBit):
-        """Trả về frame hoàn chỉnh hoặc None"""
+        """Trả về frame hoàn chỉnh (memoryview) hoặc None.
+
+        frameNum is the 32-bit frame ID from the RTP header extension, not
+        the RTP sequence number (that one changes on every fragment). The
+        marker bit is not needed: chunks striped over two ports can arrive
+        after it, so completion is decided by the bitmap alone."""
         if len(payload) < 4:
             return None
-        with self.lock:
-            idx = int.from_bytes(payload[0:2], "big")
-            total = int.from_bytes(payload[2:4], "big")
-            chunk = payload[4:]
-
-            entry = self.frameParts.setdefault(frameNum, {"total": total, "chunks": {}})
-            entry["chunks"][idx] = chunk
-
-            # ===== ĐỦ CHUNK → GHÉP FRAME =====
-            if len(entry["chunks"]) == total:
-                ba = bytearray()
-                for i in range(total):
-                    if i not in entry["chunks"]:
-                        print(f"[HD] Missing {i} in frame {frameNum}")
-                        self.frameParts.pop(frameNum, None)
-                        return None
-                    ba.extend(entry["chunks"][i])
-
-                full_frame = bytes(ba)
-
-                if not self.is_valid_jpeg(full_frame):
-                    print(f"[HD] Assembled invalid JPEG {frameNum}")
-                    self.frameParts.pop(frameNum, None)
-                    return None
-
-                self.frameParts.pop(frameNum, None)
-                return full_frame
-
-            # ===== Marker nhưng thiếu chunk → drop =====
-            if markerBit and len(entry["chunks"]) != total:
-                print(f"[HD] Drop frame {frameNum}: missing chunks")
-                self.frameParts.pop(frameNum, None)
+        idx = int.from_bytes(payload[0:2], "big")
+        total = int.from_bytes(payload[2:4], "big")
+        chunk = payload[4:]
+        if idx & PARITY_FLAG:
+            group = idx & ~PARITY_FLAG
+            if not self.fec_group or group * self.fec_group >= total:
+                return None
+        elif idx >= total:
+            return None
+
+        slot = self.frameParts.get(frameNum)
+        if slot is None:
+            if frameNum > self.newest:
+                self.newest = frameNum
+                self.repair_older(frameNum)
+                self.evict_stale()
+            elif self.newest - frameNum > self.window or frameNum in self.finished:
+                return None  # late chunk of a frame already finished or given up on
+            slot = self.frameParts[frameNum] = FrameSlot(total, self.chunk_size)
+        elif slot.total != total:
+            self.drop(frameNum, "inconsistent chunk count")
+            return None
 
+        if idx & PARITY_FLAG:
+            if group in slot.parity:
+                return None  # duplicate
+            slot.parity[group] = bytes(chunk)  # chunk is a view of the receive ring
+            slot.last = monotonic()
             return None
+        else:
+            if slot.bitmap[idx]:
+                return None  # duplicate
+
+            n = len(chunk)
+            last = idx == total - 1
+            if n > self.chunk_size or (not last and n != self.chunk_size):
+                # sender fragments with a different size: adopt it for new frames
+                if not last:
+                    self.chunk_size = n
+                self.drop(frameNum, f"unexpected chunk size {n}")
+                return None
+            self.store(slot, idx, chunk)
+
+        # ===== ĐỦ CHUNK → FRAME HOÀN CHỈNH =====
+        if slot.received < total:
+            return None
+        return self.finish(frameNum, slot)
+
+    def finish(self, frameNum, slot):
+        del self.frameParts[frameNum]
+        self.finished.add(frameNum)
+        full_frame = slot.view[:slot.size]
+        if not self.is_valid_jpeg(full_frame):
+            print(f"[HD] Assembled invalid JPEG {frameNum}")
+            self.dropped += 1
+            return None
+        self.completed += 1
+        self.latency = monotonic() - slot.born
+        self.repaired = slot.nacks > 0
+        return full_frame
+
+    def store(self, slot, idx, chunk):
+        offset = idx * self.chunk_size
+        n = len(chunk)
+        slot.view[offset:offset + n] = chunk
+        slot.bitmap[idx] = 1
+        slot.received += 1
+        slot.last = monotonic()
+        if idx == slot.total - 1:
+            slot.size = offset + n
+
+    def repair_older(self, frameNum):
+        """A newer frame has started: for the older in-flight frames that
+        are settled, rebuild what parity can and NACK what it cannot.
+        Repairing sooner would 'recover' chunks still queued on the other
+        port. Frames completed by FEC go to self.ready."""
+        now = monotonic()
+        for older in [n for n in self.frameParts if n < frameNum]:
+            slot = self.frameParts[older]
+            if frameNum - older < self.repair_lag and now - slot.last < self.grace:
+                continue  # the rest may still be on its way
+            for group in slot.parity:
+                self.recover(slot, group)
+            if slot.received == slot.total:
+                frame = self.finish(older, slot)
+                if frame is not None:
+                    self.ready.append((older, frame))
+            elif slot.nacks < self.nack_retries:
+                missing = [i for i in range(slot.total) if not slot.bitmap[i]]
+                if len(missing) <= self.nack_max:
+                    slot.nacks += 1
+                    self.nacked += len(missing)
+                    self.nacks.append((older, missing))
+
+    def repair_settled(self):
+        """repair_older() for frames past the grace period, the newest included."""
+        self.repair_older(self.newest + 1)
+
+    def take_nacks(self):
+        """(frameNum, missing indices) to request since the last call."""
+        nacks, self.nacks = self.nacks, []
+        return nacks
+
+    def take_ready(self):
+        """Frames completed by FEC repair since the last call, as (frameNum, frame)."""
+        ready, self.ready = self.ready, []
+        return ready
+
+    def recover(self, slot, group):
+        """Rebuild the one missing chunk of a group from its parity, if possible."""
+        parity = slot.parity.get(group)
+        if parity is None:
+            return
+        first = group * self.fec_group
+        members = range(first, min(first + self.fec_group, slot.total))
+        missing = [i for i in members if not slot.bitmap[i]]
+        if len(missing) != 1:
+            return  # nothing to do, or more losses than XOR can repair
+        size = self.chunk_size
+        last = slot.total - 1
+        chunks = [slot.view[i * size:slot.size if i == last else (i + 1) * size]
+                  for i in members if i != missing[0]]
+        self.store(slot, missing[0], recoverChunk(parity, chunks, size))
+        self.recovered += 1
+
+    def drop(self, frameNum, reason):
+        print(f"[HD] Drop frame {frameNum}: {reason}")
+        self.frameParts.pop(frameNum, None)
+        self.finished.add(frameNum)
+        self.dropped += 1
+
+    def evict_stale(self):
+        """Give up on incomplete frames that are too old or too far behind."""
+        now = monotonic()
+        for frameNum in list(self.frameParts):
+            slot = self.frameParts[frameNum]
+            if self.newest - frameNum > self.window or now - slot.born > self.max_age:
+                print(f"[HD] Evict frame {frameNum}: "
+                      f"{slot.received}/{slot.total} chunks")
+                del self.frameParts[frameNum]
+                self.finished.add(frameNum)
+                self.evicted += 1
+        self.finished = {f for f in self.finished if self.newest - f <= self.window}
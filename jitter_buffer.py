@@ -0,0 +1,69 @@
+# jitter_buffer.py
+import math
+from time import monotonic
+
+from RtpPacket import CLOCK_RATE
+
+
+class JitterBuffer:
+    """
+    Chooses how deep the client's playout buffer should be.
+
+    onFrame() is fed every completed frame with its RTP timestamp and how
+    long it took to assemble (first to last fragment). From that it keeps
+    the RFC 3550 interarrival jitter estimate J and a peak-following
+    completion latency, and targetDelay() = 4 J + completion, clamped to
+    [min_latency, max_latency]. Playback starts (and restarts after an
+    underrun) once that much media is buffered: a clean link starts after
+    min_latency, a bad one buffers more, never beyond max_latency.
+    """
+
+    JITTER_GAIN = 1 / 16  # RFC 3550 A.8
+    JITTER_MULT = 4  # arrivals within ~4 J of the expected time are absorbed
+    DECAY = 0.98  # completion latency falls back slowly after a spike
+
+    def __init__(self, min_latency=0.1, max_latency=2.0, clock=monotonic):
+        self.min_latency = min_latency
+        self.max_latency = max_latency
+        self.clock = clock
+        self.reset()
+
+    def reset(self):
+        self.jitter = 0.0  # seconds
+        self.completion = 0.0  # seconds
+        self.lastArrival = None
+        self.lastTimestamp = None
+        self.frames = 0
+
+    def onFrame(self, timestamp, completion=0.0):
+        """Record a completed frame (RTP timestamp, assembly time in seconds)."""
+        now = self.clock()
+        if self.lastArrival is not None:
+            # 32-bit wrap-safe timestamp difference, in seconds
+            dts = ((timestamp - self.lastTimestamp + 0x80000000) & 0xFFFFFFFF) - 0x80000000
+            d = (now - self.lastArrival) - dts / CLOCK_RATE
+            self.jitter += (abs(d) - self.jitter) * self.JITTER_GAIN
+        self.lastArrival = now
+        self.lastTimestamp = timestamp
+        self.completion = max(completion, self.completion * self.DECAY)
+        self.frames += 1
+
+    def targetDelay(self):
+        """Seconds of media to hold before (re)starting playback."""
+        delay = self.JITTER_MULT * self.jitter + self.completion
+        return min(max(delay, self.min_latency), self.max_latency)
+
+    def targetFrames(self, fps):
+        return max(1, math.ceil(self.targetDelay() * fps))
+
+    def maxFrames(self, fps):
+        """Most frames worth buffering (upper latency bound)."""
+        return max(1, math.ceil(self.max_latency * fps))
+
+    def stats(self):
+        return {
+            "jitter_ms": 1e3 * self.jitter,
+            "completion_ms": 1e3 * self.completion,
+            "target_ms": 1e3 * self.targetDelay(),
+            "frames": self.frames,
+        }
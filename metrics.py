@@ -0,0 +1,199 @@
+# metrics.py
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from time import monotonic
+
+
+class Timing:
+    """Count / sum / max of a duration in seconds."""
+
+    __slots__ = ("count", "total", "max")
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds):
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def avg(self):
+        return self.total / self.count if self.count else 0.0
+
+
+class SessionMetrics:
+    """
+    Counters of one streaming session, read by scrapes; plain attribute
+    updates, no lock. Each counter has a single writer: the session's
+    sender (thread or event-loop callbacks) for everything except
+    `retransmitted`, which the RTCP listener updates when it answers
+    NACKs (the event loop itself in the async engine).
+    """
+
+    RATE_GAIN = 0.1  # EWMA weight of the newest frame in fps / bytes per second
+
+    def __init__(self, session=0, mode="sd", targetFps=0.0, clock=monotonic):
+        self.session = session
+        self.mode = mode
+        self.targetFps = targetFps
+        self.clock = clock
+        self.framesSent = 0
+        self.packetsSent = 0
+        self.bytesSent = 0
+        self.retransmitted = 0
+        self.fps = 0.0
+        self.bytesPerSecond = 0.0
+        self.lastFrame = None
+        self.readLatency = Timing()  # fetching a frame (nextFrame / packet store)
+        self.sendLatency = Timing()  # one send call (sendto / batch send)
+        self.lateness = Timing()  # actual send time - paced slot
+
+    def onFrame(self, packets, nbytes):
+        now = self.clock()
+        self.framesSent += 1
+        self.packetsSent += packets
+        self.bytesSent += nbytes
+        if self.lastFrame is not None and now > self.lastFrame:
+            dt = now - self.lastFrame
+            if dt < 1.0:  # not across a pause
+                self.fps += (1 / dt - self.fps) * self.RATE_GAIN
+                self.bytesPerSecond += (nbytes / dt - self.bytesPerSecond) * self.RATE_GAIN
+        self.lastFrame = now
+
+    def snapshot(self):
+        return {
+            "frames_sent": self.framesSent,
+            "packets_sent": self.packetsSent,
+            "bytes_sent": self.bytesSent,
+            "retransmitted_packets": self.retransmitted,
+            "fps": round(self.fps, 2),
+            "target_fps": self.targetFps,
+            "bytes_per_second": round(self.bytesPerSecond),
+            "read_latency_avg_ms": round(1e3 * self.readLatency.avg(), 3),
+            "read_latency_max_ms": round(1e3 * self.readLatency.max, 3),
+            "send_latency_avg_ms": round(1e3 * self.sendLatency.avg(), 3),
+            "send_latency_max_ms": round(1e3 * self.sendLatency.max, 3),
+            "pacing_lateness_avg_ms": round(1e3 * self.lateness.avg(), 3),
+            "pacing_lateness_max_ms": round(1e3 * self.lateness.max, 3),
+        }
+
+
+class MetricsRegistry:
+    """Every live session's metrics plus the server-wide shared state."""
+
+    def __init__(self, frameCache=None, packetStore=None, rtcp=None):
+        self.frameCache = frameCache
+        self.packetStore = packetStore
+        self.rtcp = rtcp
+        self.sessions = {}
+        self.lock = threading.Lock()
+        self.sessionsTotal = 0
+        self.retired = [0, 0, 0]  # frames, packets, bytes of sessions already closed
+        self.onChange = None  # called after a session comes or goes
+
+    def register(self, metrics):
+        with self.lock:
+            self.sessions[metrics.session] = metrics
+            self.sessionsTotal += 1
+        if self.onChange is not None:
+            self.onChange()
+
+    def unregister(self, metrics):
+        with self.lock:
+            if self.sessions.pop(metrics.session, None) is None:
+                return
+            self.retired[0] += metrics.framesSent
+            self.retired[1] += metrics.packetsSent
+            self.retired[2] += metrics.bytesSent
+        if self.onChange is not None:
+            self.onChange()
+
+    def totals(self):
+        """(frames, packets, bytes) sent by every session so far."""
+        with self.lock:
+            frames, packets, nbytes = self.retired
+            for m in self.sessions.values():
+                frames += m.framesSent
+                packets += m.packetsSent
+                nbytes += m.bytesSent
+        return frames, packets, nbytes
+
+    def hdSessions(self):
+        with self.lock:
+            return sum(1 for m in self.sessions.values() if m.mode == "hd")
+
+    # FrameCache / PacketStore stats() keys that are counters (the rest are gauges)
+    CACHE_COUNTERS = ("hits", "misses", "evictions")
+
+    def globals(self):
+        """Server-wide series: name -> (type, value); counters end in _total."""
+        frames, packets, nbytes = self.totals()
+        values = {
+            "sessions_active": ("gauge", len(self.sessions)),
+            "sessions_total": ("counter", self.sessionsTotal),
+            "frames_sent_total": ("counter", frames),
+            "packets_sent_total": ("counter", packets),
+            "bytes_sent_total": ("counter", nbytes),
+        }
+        for prefix, cache in (("frame_cache", self.frameCache), ("packet_store", self.packetStore)):
+            if cache is not None:
+                for key, value in cache.stats().items():
+                    if key in self.CACHE_COUNTERS:
+                        values[f"{prefix}_{key}_total"] = ("counter", value)
+                    else:
+                        values[f"{prefix}_{key}"] = ("gauge", value)
+        if self.rtcp is not None:
+            values["rtcp_invalid_packets_total"] = ("counter", self.rtcp.invalid)
+        return values
+
+    # counters among the per-session values (the rest are gauges)
+    COUNTERS = ("frames_sent", "packets_sent", "bytes_sent", "retransmitted_packets")
+
+    def render(self):
+        """Prometheus text exposition format."""
+        lines = []
+        for name, (kind, value) in self.globals().items():
+            lines.append(f"# TYPE rtsp_{name} {kind}")
+            lines.append(f"rtsp_{name} {value}")
+        with self.lock:
+            sessions = list(self.sessions.values())
+        if sessions:
+            rows = [(m, m.snapshot()) for m in sessions]
+            for name in rows[0][1]:
+                metric = f"rtsp_session_{name}" + ("_total" if name in self.COUNTERS else "")
+                kind = "counter" if name in self.COUNTERS else "gauge"
+                lines.append(f"# TYPE {metric} {kind}")
+                for m, snapshot in rows:
+                    lines.append(f'{metric}{{session="{m.session}",mode="{m.mode}"}} {snapshot[name]}')
+        return "\n".join(lines) + "\n"
+
+
+class MetricsServer:
+    """GET /metrics on a local port, served from a daemon thread."""
+
+    def __init__(self, registry, port, host="127.0.0.1"):
+        registry_ = registry
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] not in ("/", "/metrics"):
+                    self.send_error(404)
+                    return
+                body = registry_.render().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass  # scrapes every few seconds would flood the console
+
+        self.httpd = ThreadingHTTPServer((host, port), Handler)
+        self.httpd.daemon_threads = True
+
+    def start(self):
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
@@ -0,0 +1,73 @@
+# pacer.py
+import threading
+from time import monotonic
+
+
+class TokenBucket:
+    """
+    Token bucket in bytes. reserve() takes the tokens right away (the level
+    may go negative) and returns how long to wait before sending, so it
+    works for both blocking threads and event-loop timers.
+    rate <= 0 means unlimited.
+    """
+
+    def __init__(self, rate, burst, clock=monotonic):
+        self.rate = rate  # bytes per second
+        self.burst = burst  # bucket depth in bytes
+        self.clock = clock
+        self.tokens = burst
+        self.last = clock()
+        self.lock = threading.Lock()
+
+    def reserve(self, nbytes):
+        if self.rate <= 0:
+            return 0.0
+        with self.lock:
+            now = self.clock()
+            self.tokens = min(self.burst, self.tokens + (now - self.last) * self.rate)
+            self.last = now
+            self.tokens -= nbytes
+            if self.tokens >= 0:
+                return 0.0
+            return -self.tokens / self.rate
+
+
+class Pacer:
+    """
+    Per-session packet pacing: a frame's batches are spread evenly over
+    SPREAD of the frame interval, and each batch also waits for the session
+    and global buckets.
+    """
+
+    # leave the tail of the interval free so a frame never runs into the next one
+    SPREAD = 0.8
+
+    def __init__(self, sessionBucket, globalBucket=None, clock=monotonic):
+        self.sessionBucket = sessionBucket
+        self.globalBucket = globalBucket
+        self.clock = clock
+
+    def slot(self, start, index, count, interval):
+        """Evenly spaced send time of batch `index` out of `count`."""
+        if count <= 1:
+            return start
+        return start + interval * self.SPREAD * index / count
+
+    def reserve(self, nbytes):
+        """Take tokens for nbytes from both buckets; return the delay in seconds."""
+        delay = self.sessionBucket.reserve(nbytes)
+        if self.globalBucket is not None:
+            delay = max(delay, self.globalBucket.reserve(nbytes))
+        return delay
+
+
+class PacingPolicy:
+    """Server-wide pacing settings plus the global bucket shared by all sessions."""
+
+    def __init__(self, session_rate_mbps=0, global_rate_mbps=0, burst_kb=64):
+        self.sessionRate = session_rate_mbps * 1e6 / 8
+        self.burst = burst_kb * 1024
+        self.globalBucket = TokenBucket(global_rate_mbps * 1e6 / 8, self.burst)
+
+    def newPacer(self):
+        return Pacer(TokenBucket(self.sessionRate, self.burst), self.globalBucket)
@@ -0,0 +1,22 @@
+# packet_store.py
+from frame_cache import FrameCache
+
+
+def fragmentFrame(frame, size):
+    """Split a frame into RTP payloads: 2-byte idx + 2-byte total + up to `size` bytes."""
+    total = (len(frame) + size - 1) // size
+    prefixTotal = total.to_bytes(2, "big")
+    return [idx.to_bytes(2, "big") + prefixTotal + frame[idx * size:(idx + 1) * size]
+            for idx in range(total)]
+
+
+class PacketStore(FrameCache):
+    """
+    Shared store of pre-fragmented HD frames.
+    Key = (file, frame number, fragment size) -> list of RTP payloads, built
+    once and reused by every session; a session only writes its own
+    12-byte RTP headers in front of them.
+    """
+
+    def put(self, key, fragments):
+        super().put(key, fragments, size=sum(len(f) for f in fragments))
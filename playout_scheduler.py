@@ -0,0 +1,90 @@
+# playout_scheduler.py
+from time import monotonic
+
+
+class PlayoutScheduler:
+    """
+    Presentation clock for the client.
+
+    Frame n is due at base + (n - 1) / fps on the monotonic clock; the
+    base is anchored on the first frame shown after start/resume. Frames
+    already more than `lateness` frame intervals past their deadline are
+    skipped before decoding (see DecodePipeline.fill), so a client that
+    fell behind catches up instead of drifting further and further back.
+    When a late frame has to be shown anyway (the buffer ran dry) the
+    clock is re-anchored on it: that is a rebuffer, not drift.
+    """
+
+    def __init__(self, fps=25.0, lateness=1.0, clock=monotonic):
+        self.clock = clock
+        self.lateness = lateness
+        self.setFps(fps)
+        self.base = None
+        self.lastShown = None
+
+        # counters
+        self.shown = 0
+        self.skipped = 0
+        self.rebuffers = 0
+
+    def setFps(self, fps):
+        self.fps = float(fps)
+        self.interval = 1.0 / self.fps
+
+    def reset(self):
+        """Re-anchor on the next frame shown (start, resume, seek)."""
+        self.base = None
+        self.lastShown = None
+
+    def pts(self, frameNum):
+        return (frameNum - 1) * self.interval
+
+    def deadline(self, frameNum):
+        if self.base is None:
+            return None
+        return self.base + self.pts(frameNum)
+
+    def isLate(self, frameNum):
+        """True if frameNum's deadline has already passed by more than `lateness` intervals."""
+        deadline = self.deadline(frameNum)
+        return deadline is not None and self.clock() - deadline > self.lateness * self.interval
+
+    def skip(self, frameNum):
+        self.skipped += 1
+
+    def due(self, frameNum):
+        """Seconds until frameNum should be shown (<= 0: show it now)."""
+        now = self.clock()
+        deadline = self.deadline(frameNum)
+        if deadline is None:
+            self.base = now - self.pts(frameNum)
+            return 0.0
+        if now - deadline > self.lateness * self.interval:
+            self.base = now - self.pts(frameNum)
+            self.rebuffers += 1
+            return 0.0
+        return deadline - now
+
+    def markShown(self, frameNum):
+        self.shown += 1
+        self.lastShown = frameNum
+
+    def nextDelay(self):
+        """Seconds until the frame after the last one shown is due, within (0, interval]."""
+        if self.lastShown is None:
+            return self.interval
+        wait = self.deadline(self.lastShown + 1) - self.clock()
+        return min(max(wait, 0.001), self.interval)
+
+    def skipRate(self):
+        total = self.shown + self.skipped
+        return self.skipped / total if total else 0.0
+
+    def stats(self):
+        return {
+            "fps": self.fps,
+            "shown": self.shown,
+            "skipped": self.skipped,
+            "skip_rate": self.skipRate(),
+            "rebuffers": self.rebuffers,
+        }
@@ -0,0 +1,229 @@
+# prefork.py
+"""
+Prefork mode (Linux): one server process per core, all accepting RTSP
+connections on the same port through SO_REUSEPORT listeners, so file
+reading, packetization and sendto() are no longer serialized by one GIL.
+
+The supervisor restarts workers that die and aggregates their counters,
+which every worker publishes into a shared array (one row per worker).
+Worker i receives RTCP on RTSP port + 1 + i (advertised in its SETUP
+replies). A new HD client that lands on a busier worker is handed to the
+worker with the fewest HD sessions: its connection fd and first request
+travel over a Unix datagram socket (SCM_RIGHTS).
+"""
+import array
+import multiprocessing
+import os
+import signal
+import socket
+import sys
+import threading
+import time
+
+from metrics import MetricsServer
+
+FIELDS = ("pid", "sessions", "hd_sessions", "frames_sent", "packets_sent", "bytes_sent")
+
+
+class WorkerLoad:
+    """Per-worker counters in shared memory; each worker writes only its own row."""
+
+    def __init__(self, context, workers):
+        self.workers = workers
+        self.values = context.Array('q', workers * len(FIELDS), lock=False)
+
+    def get(self, index, field):
+        return self.values[index * len(FIELDS) + FIELDS.index(field)]
+
+    def set(self, index, field, value):
+        self.values[index * len(FIELDS) + FIELDS.index(field)] = value
+
+    def row(self, index):
+        start = index * len(FIELDS)
+        return dict(zip(FIELDS, self.values[start:start + len(FIELDS)]))
+
+    def clear(self, index):
+        for field in FIELDS:
+            self.set(index, field, 0)
+
+
+class Handoff:
+    """Passes new HD connections to the least-loaded live worker."""
+
+    def __init__(self, port, index, load):
+        self.port = port
+        self.index = index
+        self.load = load
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self.handedOff = 0
+
+    def address(self, index):
+        return f"\0rtsp-{self.port}-worker-{index}"  # abstract namespace: nothing on disk
+
+    def listen(self, adopt):
+        """Bind this worker's address; adopt(sock, data) runs on a thread for
+        every connection handed over, with the request already read from it."""
+        self.sock.bind(self.address(self.index))
+        threading.Thread(target=self.run, args=(adopt,), daemon=True).start()
+
+    def run(self, adopt):
+        while True:
+            try:
+                data, fds, _, _ = socket.recv_fds(self.sock, 4096, 1)
+            except OSError:
+                break
+            for fd in fds:
+                adopt(socket.socket(fileno=fd), data)
+
+    def offer(self, sock, data):
+        """Hand the connection over if its first request is an HD SETUP and
+        another worker has fewer HD sessions; True if it is gone."""
+        if not data.startswith(b"SETUP") or b"Prefer: HD" not in data:
+            return False
+        loads = [(self.load.get(i, "hd_sessions"), i) for i in range(self.load.workers)
+                 if self.load.get(i, "pid")]
+        if not loads:
+            return False
+        least, target = min(loads)
+        if target == self.index or self.load.get(self.index, "hd_sessions") <= least:
+            return False
+        try:
+            # socket.send_fds() drops its address argument (3.9-3.11): sendmsg() directly
+            self.sock.sendmsg([data], [(socket.SOL_SOCKET, socket.SCM_RIGHTS,
+                                        array.array("i", [sock.fileno()]))],
+                              0, self.address(target))
+        except OSError as exc:
+            print("[PREFORK] Handoff failed:", exc)
+            return False
+        # count it right away so a burst of clients spreads out; the target
+        # overwrites this with its real count once the session is set up
+        self.load.set(target, "hd_sessions", least + 1)
+        self.handedOff += 1
+        return True
+
+
+class Worker:
+    """One prefork worker process as seen from inside it."""
+
+    PUBLISH_INTERVAL = 1.0
+
+    def __init__(self, index, port, load):
+        self.index = index
+        self.port = port
+        self.load = load
+        self.registry = None
+        self.listener = None
+        self.handoff = None
+
+    def start(self):
+        self.listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        self.listener.bind(('', self.port))
+        self.listener.listen(5)
+        self.handoff = Handoff(self.port, self.index, self.load)
+
+    def attach(self, registry):
+        """Publish the registry's counters: on every new/closed session and
+        once a second."""
+        self.registry = registry
+        self.load.set(self.index, "pid", os.getpid())
+        registry.onChange = self.publish
+        threading.Thread(target=self.publishLoop, daemon=True).start()
+
+    def publish(self):
+        sessions = len(self.registry.sessions)
+        frames, packets, nbytes = self.registry.totals()
+        self.load.set(self.index, "sessions", sessions)
+        self.load.set(self.index, "hd_sessions", self.registry.hdSessions())
+        self.load.set(self.index, "frames_sent", frames)
+        self.load.set(self.index, "packets_sent", packets)
+        self.load.set(self.index, "bytes_sent", nbytes)
+
+    def publishLoop(self):
+        while True:
+            time.sleep(self.PUBLISH_INTERVAL)
+            self.publish()
+
+
+class Supervisor:
+    """Starts `workers` server processes and keeps them running."""
+
+    CHECK_INTERVAL = 1.0
+    STATS_INTERVAL = 10.0  # seconds between aggregate stats lines
+
+    def __init__(self, server, args, workers):
+        self.server = server  # Server: serve(args, worker) runs one process
+        self.args = args
+        self.context = multiprocessing.get_context("fork")
+        self.load = WorkerLoad(self.context, workers)
+        self.procs = [None] * workers
+        self.restarts = [0] * workers
+
+    def spawn(self, index):
+        self.load.clear(index)
+        proc = self.context.Process(target=self.runWorker, args=(index,), daemon=True)
+        proc.start()
+        self.procs[index] = proc
+
+    def runWorker(self, index):
+        signal.signal(signal.SIGINT, signal.SIG_IGN)  # the supervisor stops us
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        worker = Worker(index, self.args.port, self.load)
+        worker.start()
+        self.server.serve(self.args, worker)
+
+    def run(self):
+        print(f"[PREFORK] {len(self.procs)} workers on port {self.args.port},"
+              f" RTCP ports {self.args.port + 1}-{self.args.port + len(self.procs)}")
+        # terminate the workers too, or they keep the port after we are gone
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+        for i in range(len(self.procs)):
+            self.spawn(i)
+        if self.args.metrics_port:
+            MetricsServer(self, self.args.metrics_port).start()
+            print("Metrics on http://127.0.0.1:%d/metrics" % self.args.metrics_port)
+        nextStats = time.monotonic() + self.STATS_INTERVAL
+        try:
+            while True:
+                time.sleep(self.CHECK_INTERVAL)
+                for i, proc in enumerate(self.procs):
+                    if not proc.is_alive():
+                        print(f"[PREFORK] Worker {i} (pid {proc.pid}) exited with {proc.exitcode},"
+                              " restarting")
+                        self.restarts[i] += 1
+                        self.spawn(i)
+                if time.monotonic() >= nextStats:
+                    nextStats += self.STATS_INTERVAL
+                    print("[PREFORK]", self.summary())
+        except KeyboardInterrupt:
+            pass
+        finally:
+            for proc in self.procs:
+                proc.terminate()
+            for proc in self.procs:
+                proc.join(timeout=2)
+
+    def summary(self):
+        rows = [self.load.row(i) for i in range(len(self.procs))]
+        total = {field: sum(r[field] for r in rows) for field in FIELDS[1:]}
+        total["restarts"] = sum(self.restarts)
+        total["hd_per_worker"] = [r["hd_sessions"] for r in rows]
+        return total
+
+    def render(self):
+        """Prometheus text: the workers' counters, labelled by worker."""
+        lines = []
+        rows = [self.load.row(i) for i in range(len(self.procs))]
+        for field in FIELDS[1:]:
+            counter = field.endswith("_sent")
+            metric = f"rtsp_worker_{field}" + ("_total" if counter else "_active")
+            lines.append(f"# TYPE {metric} {'counter' if counter else 'gauge'}")
+            for i, row in enumerate(rows):
+                lines.append(f'{metric}{{worker="{i}"}} {row[field]}')
+        lines.append("# TYPE rtsp_worker_restarts_total counter")
+        for i, restarts in enumerate(self.restarts):
+            lines.append(f'rtsp_worker_restarts_total{{worker="{i}"}} {restarts}')
+        lines.append("# TYPE rtsp_sessions_active gauge")
+        lines.append(f"rtsp_sessions_active {sum(r['sessions'] for r in rows)}")
+        return "\n".join(lines) + "\n"
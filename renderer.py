@@ -5,13 +5,25 @@ import io
 class Renderer:
     """
     Chỉ chịu trách nhiệm scale ảnh và vẽ lên canvas.
+
+    The hot path runs on the Tk thread, so it does as little as possible:
+    JPEGs are DCT-scaled while decoding (Image.draft), the letterbox
+    geometry is cached per (source size, canvas size), the letterbox
+    itself is the canvas' black background, and one PhotoImage is reused
+    with paste() until the display size changes.
     """
 
+    # at or beyond this downscale factor LANCZOS costs a lot and buys nothing
+    FAST_FILTER_FACTOR = 2.0
+
     def __init__(self, canvas, target_w, target_h):
         self.canvas = canvas
         self.canvas_image_id = None
         self.canvas_width = target_w
         self.canvas_height = target_h
+        self.geometry = {}  # (sw, sh, cw, ch) -> (new_w, new_h)
+        self.photo = None  # reused PhotoImage
+        self.photo_size = None
 
     def on_resize(self, event):
         self.canvas_width = event.width
@@ -21,22 +33,52 @@ class Renderer:
                                self.canvas_width // 2,
                                self.canvas_height // 2)
 
-    def build_photo(self, jpeg_bytes: bytes):
-        cw, ch = self.canvas_width, self.canvas_height
-        img = Image.open(io.BytesIO(jpeg_bytes)).convert("RGB")
+    def fit(self, sw, sh):
+        """Letterboxed display size of a sw x sh source on the current canvas."""
+        key = (sw, sh, self.canvas_width, self.canvas_height)
+        size = self.geometry.get(key)
+        if size is None:
+            cw, ch = self.canvas_width, self.canvas_height
+            scale = min(cw / sw, ch / sh)
+            size = (max(1, int(sw * scale)), max(1, int(sh * scale)))
+            if len(self.geometry) > 64:
+                self.geometry.clear()  # canvas was resized many times
+            self.geometry[key] = size
+        return size
+
+    def decode(self, jpeg_bytes):
+        """JPEG -> RGB image at display size. Touches no Tk state, so it can
+        run on a worker thread (see decode_pipeline.DecodePipeline)."""
+        img = Image.open(io.BytesIO(jpeg_bytes))
+        new_w, new_h = self.fit(*img.size)
+
+        # decode straight to the smallest DCT scale (1/2, 1/4, 1/8) >= target
+        img.draft("RGB", (new_w, new_h))
+        if img.mode != "RGB":
+            img = img.convert("RGB")
 
-        sw, sh = img.size
-        scale = min(cw / sw, ch / sh)
-        new_w = int(sw * scale)
-        new_h = int(sh * scale)
-        img = img.resize((new_w, new_h), Image.LANCZOS)
+        if img.size != (new_w, new_h):
+            factor = img.size[0] / new_w
+            resample = Image.BILINEAR if factor >= self.FAST_FILTER_FACTOR else Image.LANCZOS
+            img = img.resize((new_w, new_h), resample)
+        else:
+            img.load()  # decode now, not lazily on the Tk thread
+        return img
+
+    def to_photo(self, img):
+        """Paste into the reused PhotoImage; must run on the Tk thread."""
+        if self.photo is None or self.photo_size != img.size:
+            self.photo = ImageTk.PhotoImage(img)
+            self.photo_size = img.size
+        else:
+            self.photo.paste(img)
+        return self.photo
 
-        # Letterbox
-        canvas_img = Image.new("RGB", (cw, ch), "black")
-        offset = ((cw - new_w) // 2, (ch - new_h) // 2)
-        canvas_img.paste(img, offset)
+    def build_photo(self, jpeg_bytes):
+        return self.to_photo(self.decode(jpeg_bytes))
 
-        return ImageTk.PhotoImage(canvas_img)
+    def show(self, img):
+        self.render(self.to_photo(img))
 
     def render(self, photo):
         cx = self.canvas_width // 2
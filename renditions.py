@@ -0,0 +1,115 @@
+# renditions.py
+import io
+import os
+import threading
+
+from PIL import Image
+
+from VideoStream import VideoStream
+
+
+# name, max width, max height, JPEG quality; best first. "source" is the
+# original file; the others are transcoded once and kept next to it.
+LADDER = (
+    ("source", None, None, None),
+    ("540p", 960, 540, 75),
+    ("360p", 640, 360, 70),
+)
+
+
+class RenditionStore:
+    """
+    Lazily built, disk-cached renditions of every title.
+
+    A rendition of "movie_HD.Mjpeg" is "movie_HD.540p.Mjpeg" (raw JPEGs,
+    read in "hd" mode). It is transcoded on a background thread the first
+    time a session asks for it, and reused by later sessions and server
+    runs as long as it is newer than the source. Streaming only ever
+    switches to renditions that are already on disk, so a switch never
+    costs inline transcoding.
+    """
+
+    def __init__(self, ladder=LADDER):
+        self.ladder = ladder
+        self.lock = threading.Lock()
+        self.building = set()  # paths being transcoded
+        self.sizes = {}  # source path -> (width, height) of its first frame
+
+    def path(self, source, name):
+        if name == "source":
+            return source
+        root, ext = os.path.splitext(source)
+        return f"{root}.{name}{ext}"
+
+    def renditions(self, stream):
+        """Ladder entries that make sense for an open source stream, best first:
+        only those smaller than the source."""
+        size = self.sizes.get(stream.filename)
+        if size is None:
+            frame = stream.frameAt(1)
+            if not frame:
+                return []
+            try:
+                size = Image.open(io.BytesIO(frame)).size
+            except OSError:
+                return []
+            self.sizes[stream.filename] = size
+        w, h = size
+        return [r for r in self.ladder
+                if r[1] is None or (r[1] < w and r[2] < h)]
+
+    def ready(self, source, name):
+        if name == "source":
+            return True
+        path = self.path(source, name)
+        try:
+            return os.stat(path).st_mtime_ns >= os.stat(source).st_mtime_ns
+        except OSError:
+            return False
+
+    def request(self, source, mode, rendition):
+        """Make sure `rendition` of a title is on disk or being built."""
+        name = rendition[0]
+        if self.ready(source, name):
+            return
+        path = self.path(source, name)
+        with self.lock:
+            if path in self.building:
+                return
+            self.building.add(path)
+        threading.Thread(target=self.build, args=(source, mode, rendition, path),
+                         daemon=True).start()
+
+    def open(self, source, mode, name, cache=None):
+        """Open a ready rendition of a title."""
+        if name == "source":
+            return VideoStream(source, mode=mode, cache=cache)
+        return VideoStream(self.path(source, name), mode="hd", cache=cache)
+
+    def build(self, source, mode, rendition, path):
+        name, width, height, quality = rendition
+        tmp = "%s.%d.tmp" % (path, os.getpid())  # several server processes may build it
+        print(f"[RENDITION] Building {path}")
+        try:
+            stream = VideoStream(source, mode=mode)
+            try:
+                with open(tmp, "wb") as out:
+                    for n in range(1, stream.totalFrames + 1):
+                        img = Image.open(io.BytesIO(stream.frameAt(n)))
+                        img.draft("RGB", (width, height))  # DCT-scaled decode
+                        img = img.convert("RGB")
+                        img.thumbnail((width, height), Image.BILINEAR)
+                        img.save(out, format="JPEG", quality=quality)
+            finally:
+                stream.close()
+            os.replace(tmp, path)
+            print(f"[RENDITION] Ready {path}")
+        except (OSError, ValueError) as exc:
+            print(f"[RENDITION] Failed {path}:", exc)
+            try:
+                os.remove(tmp)
+            except OSError:
+                pass
+        finally:
+            with self.lock:
+                self.building.discard(path)
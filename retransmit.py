@@ -0,0 +1,56 @@
+# retransmit.py
+from collections import OrderedDict
+from time import monotonic
+
+
+class RetransmitRing:
+    """
+    The last `frames` HD frames a session sent, for NACK retransmission.
+
+    Fragments are shared with the packet store; only the RTP headers are
+    copied, because the session rewrites its header buffers every frame.
+    lookup() refuses frames the client's playout has already passed and
+    frames older than max_age, so a retransmit is never wasted on a frame
+    that can no longer be shown.
+    """
+
+    def __init__(self, frames=32, max_age=1.0, clock=monotonic):
+        self.frames = frames
+        self.max_age = max_age
+        self.clock = clock
+        self.ring = OrderedDict()  # frameNum -> (sent at, [((header, fragment), address)])
+
+        # counters
+        self.requested = 0
+        self.resent = 0
+        self.expired = 0
+
+    def add(self, frameNum, packets):
+        self.ring[frameNum] = (self.clock(), [((bytes(header), fragment), address)
+                                              for (header, fragment), address in packets])
+        while len(self.ring) > self.frames:
+            self.ring.popitem(last=False)
+
+    def lookup(self, frameNum, indices, playhead=0):
+        """Packets carrying the given fragment indices of frameNum, or []."""
+        self.requested += len(indices)
+        entry = self.ring.get(frameNum)
+        if entry is None or frameNum < playhead or self.clock() - entry[0] > self.max_age:
+            self.expired += len(indices)
+            return []
+        wanted = set(indices)
+        packets = [packet for packet in entry[1]
+                   if int.from_bytes(packet[0][1][:2], "big") in wanted]
+        self.resent += len(packets)
+        return packets
+
+    def clear(self):
+        self.ring.clear()
+
+    def stats(self):
+        return {
+            "frames": len(self.ring),
+            "requested": self.requested,
+            "resent": self.resent,
+            "expired": self.expired,
+        }
@@ -0,0 +1,144 @@
+# rtcp.py
+import socket
+import struct
+import threading
+from time import monotonic
+
+from RtpPacket import CLOCK_RATE
+
+PT_RR = 201
+PT_APP = 204
+APP_NAME = b"VSTR"  # our application-defined stats block
+NACK_NAME = b"NACK"  # lost HD fragments of one frame
+
+# V=2 P=0 count, PT, length in 32-bit words - 1
+_HEADER = struct.Struct("!BBH")
+# reporter SSRC + one report block: source SSRC, fraction lost + cumulative
+# lost (24 bit), extended highest seq, jitter, LSR, DLSR
+_RR = struct.Struct("!II B3s IIII")
+# reporter SSRC, name, frames completed, frames dropped, throughput (kbit/s)
+_APP = struct.Struct("!I4s III")
+# reporter SSRC, name, sender SSRC, frame ID, client playhead, index count;
+# followed by the u16 fragment indices, zero-padded to 32 bits
+_NACK = struct.Struct("!I4s IIIH2x")
+
+
+def buildReport(ssrc, sourceSsrc, fractionLost, cumulativeLost, extendedMax, jitter,
+                completed, dropped, throughput):
+    """Compound RTCP packet: receiver report + VSTR app block.
+
+    jitter is in RTP timestamp units, throughput in bit/s."""
+    cumulative = max(-0x800000, min(cumulativeLost, 0x7FFFFF)) & 0xFFFFFF
+    rr = _HEADER.pack(0x81, PT_RR, _RR.size // 4) + _RR.pack(
+        ssrc, sourceSsrc, min(255, int(fractionLost * 256)), cumulative.to_bytes(3, "big"),
+        extendedMax & 0xFFFFFFFF, int(jitter) & 0xFFFFFFFF, 0, 0)
+    app = _HEADER.pack(0x80, PT_APP, _APP.size // 4) + _APP.pack(
+        ssrc, APP_NAME, completed & 0xFFFFFFFF, dropped & 0xFFFFFFFF,
+        min(int(throughput / 1000), 0xFFFFFFFF))
+    return rr + app
+
+
+def buildNack(ssrc, sourceSsrc, frameId, playhead, indices):
+    """APP packet asking the sender to resend fragments of one frame; the
+    playhead (next frame the client will play) lets it skip stale frames."""
+    body = _NACK.pack(ssrc, NACK_NAME, sourceSsrc, frameId & 0xFFFFFFFF,
+                      playhead & 0xFFFFFFFF, len(indices))
+    body += struct.pack("!%dH" % len(indices), *indices)
+    body += b"\0" * (-len(body) % 4)
+    return _HEADER.pack(0x80, PT_APP, len(body) // 4) + body
+
+
+def parseReport(data):
+    """Decode a packet from buildReport() or buildNack(); None if it is
+    neither. The SSRC being reported on (our sender's) is under "source";
+    a NACK is under "nack" as (frame ID, playhead, indices)."""
+    report = {}
+    pos = 0
+    while pos + _HEADER.size <= len(data):
+        first, pt, length = _HEADER.unpack_from(data, pos)
+        end = pos + 4 * (length + 1)
+        if first >> 6 != 2 or end > len(data):
+            return None
+        body = pos + _HEADER.size
+        if pt == PT_RR and first & 0x1F >= 1 and end - body >= _RR.size:
+            (report["ssrc"], report["source"], fraction, cumulative,
+             report["extended_max"], jitter, _, _) = _RR.unpack_from(data, body)
+            cumulative = int.from_bytes(cumulative, "big")
+            if cumulative & 0x800000:
+                cumulative -= 0x1000000
+            report["fraction_lost"] = fraction / 256
+            report["cumulative_lost"] = cumulative
+            report["jitter"] = jitter / CLOCK_RATE  # seconds
+        elif pt == PT_APP and end - body >= _APP.size:
+            name = data[body + 4:body + 8]
+            if name == APP_NAME:
+                _, _, completed, dropped, kbps = _APP.unpack_from(data, body)
+                report["frames_completed"] = completed
+                report["frames_dropped"] = dropped
+                report["throughput"] = kbps * 1000
+            elif name == NACK_NAME and end - body >= _NACK.size:
+                report["ssrc"], _, report["source"], frameId, playhead, count = \
+                    _NACK.unpack_from(data, body)
+                if end - body - _NACK.size < 2 * count:
+                    return None
+                indices = struct.unpack_from("!%dH" % count, data, body + _NACK.size)
+                report["nack"] = (frameId, playhead, indices)
+        pos = end
+    return report if "source" in report else None
+
+
+class RtcpDemux:
+    """
+    Routes receiver reports to sessions by the sender SSRC they report on
+    (each session picks a random SSRC at SETUP), so one UDP port serves
+    every session.
+    """
+
+    def __init__(self, port):
+        self.port = port  # advertised to clients in the SETUP reply
+        self.sessions = {}
+        self.lock = threading.Lock()
+        self.invalid = 0
+
+    def register(self, ssrc, session):
+        with self.lock:
+            self.sessions[ssrc] = session
+
+    def unregister(self, ssrc):
+        with self.lock:
+            self.sessions.pop(ssrc, None)
+
+    def datagramReceived(self, data, addr):
+        report = parseReport(data)
+        session = None
+        if report is not None:
+            with self.lock:
+                session = self.sessions.get(report["source"])
+        if session is None:
+            self.invalid += 1
+            return
+        report["received_at"] = monotonic()
+        if "nack" in report:
+            session.onNack(*report.pop("nack"), addr)
+        if "fraction_lost" in report:
+            session.onReceiverReport(report, addr)
+
+
+class RtcpListener:
+    """Companion UDP port (RTSP port + 1) for the threaded engine."""
+
+    def __init__(self, demux):
+        self.demux = demux
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind(('', demux.port))
+
+    def start(self):
+        threading.Thread(target=self.run, daemon=True).start()
+
+    def run(self):
+        while True:
+            try:
+                data, addr = self.sock.recvfrom(2048)
+            except OSError:
+                break
+            self.demux.datagramReceived(data, addr)
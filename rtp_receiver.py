@@ -0,0 +1,111 @@
+# rtp_receiver.py
+import selectors
+import threading
+from time import monotonic
+
+
+class RtpReceiver:
+    """
+    One receive thread for every RTP socket (selectors -> epoll on Linux).
+
+    Each readable socket is drained in bursts with recv_into() into a
+    preallocated ring of buffers, then the burst is handed to the socket's
+    callback as memoryviews. Callbacks run on this thread only, so they
+    need no per-packet locking, and must copy anything they keep: the ring
+    slot is overwritten by the next burst. Periodic jobs (every()) run on
+    the same thread, between bursts. One receiver may serve many sessions,
+    so a callback that raises (say, on a malformed datagram) only costs
+    that packet or tick: the error is counted and the thread carries on.
+    """
+
+    def __init__(self, burst=32, buffer_size=65536):
+        self.selector = selectors.DefaultSelector()
+        self.burst = burst
+        self.ring = [bytearray(buffer_size) for _ in range(burst)]
+        self.views = [memoryview(buf) for buf in self.ring]
+        self.stopEvent = threading.Event()
+        self.thread = None
+        self.timers = []  # [next run, interval, callback]; replaced, never mutated
+
+        # counters
+        self.packets = 0
+        self.bursts = 0
+        self.errors = 0  # callbacks that raised
+
+    def register(self, sock, onPacket):
+        """Watch another socket; onPacket(datagram_view) is called per datagram."""
+        sock.setblocking(False)
+        self.selector.register(sock, selectors.EVENT_READ, onPacket)
+
+    def unregister(self, sock):
+        """Stop watching a socket (before closing it)."""
+        try:
+            self.selector.unregister(sock)
+        except (KeyError, ValueError):
+            pass
+
+    def every(self, interval, callback):
+        """Run callback() on the receive thread every `interval` seconds."""
+        timer = [monotonic() + interval, interval, callback]
+        self.timers = self.timers + [timer]
+        return timer
+
+    def cancel(self, timer):
+        self.timers = [t for t in self.timers if t is not timer]
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stopEvent.set()
+        if self.thread is not None and self.thread is not threading.current_thread():
+            self.thread.join(timeout=1.0)
+
+    def run(self):
+        while not self.stopEvent.is_set():
+            try:
+                events = self.selector.select(0.1)
+            except (OSError, ValueError):
+                break  # sockets closed under us
+            for key, _ in events:
+                self.drain(key.fileobj, key.data)
+            if self.timers:
+                self.runTimers()
+        self.selector.close()
+
+    def runTimers(self):
+        now = monotonic()
+        for timer in self.timers:
+            if now >= timer[0]:
+                timer[0] = max(timer[0] + timer[1], now)
+                try:
+                    timer[2]()
+                except Exception as exc:
+                    self.onError(exc)
+
+    def drain(self, sock, onPacket):
+        sizes = []
+        for buf in self.ring:
+            try:
+                n = sock.recv_into(buf)
+            except BlockingIOError:
+                break
+            except OSError:
+                self.unregister(sock)
+                break
+            sizes.append(n)
+        if not sizes:
+            return
+        self.bursts += 1
+        self.packets += len(sizes)
+        for view, n in zip(self.views, sizes):
+            try:
+                onPacket(view[:n])
+            except Exception as exc:
+                self.onError(exc)  # e.g. a truncated datagram: drop it
+
+    def onError(self, exc):
+        self.errors += 1
+        if self.errors == 1 or self.errors % 1000 == 0:
+            print(f"[RTP] Callback error ({self.errors} so far): {exc!r}")
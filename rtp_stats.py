@@ -0,0 +1,90 @@
+# rtp_stats.py
+from time import monotonic
+
+from RtpPacket import CLOCK_RATE
+
+
+class ReceptionStats:
+    """
+    Receiver-side RTP statistics for one SSRC (RFC 3550 appendix A.3).
+
+    onPacket() runs on the RtpReceiver thread for every datagram; it
+    tracks the extended highest sequence number (with 16-bit wrap
+    cycles), packets and bytes received, and the interarrival jitter
+    (A.8, in RTP timestamp units). interval() returns the loss fraction
+    and throughput since the previous call. A new sender SSRC (new SETUP)
+    starts the counts over.
+    """
+
+    def __init__(self, clock=monotonic):
+        self.clock = clock
+        self.reset()
+
+    def reset(self, ssrc=None):
+        self.ssrc = ssrc
+        self.baseSeq = None
+        self.maxSeq = 0
+        self.cycles = 0
+        self.received = 0
+        self.bytes = 0
+        self.jitter = 0.0
+        self.transit = None  # arrival - RTP timestamp of the last in-order packet
+        # state at the previous interval() call
+        self.expectedPrior = 0
+        self.receivedPrior = 0
+        self.bytesPrior = 0
+        self.lastInterval = self.clock()
+
+    def onPacket(self, seq, size, ssrc, timestamp=None):
+        if ssrc != self.ssrc:
+            self.reset(ssrc)
+        inOrder = True
+        if self.baseSeq is None:
+            self.baseSeq = seq
+            self.maxSeq = seq
+        else:
+            delta = (seq - self.maxSeq) & 0xFFFF
+            inOrder = 0 < delta < 0x8000  # reordered/duplicate/resent packets are behind
+            if inOrder:
+                if seq < self.maxSeq:
+                    self.cycles += 0x10000
+                self.maxSeq = seq
+        self.received += 1
+        self.bytes += size
+        if timestamp is not None and inOrder:
+            # resent packets would count the NACK round trip as jitter
+            transit = self.clock() * CLOCK_RATE - timestamp
+            if self.transit is not None:
+                d = abs(transit - self.transit)
+                self.jitter += (d - self.jitter) / 16
+            self.transit = transit
+
+    def resync(self):
+        """RTP timestamps jump against arrival time (PLAY after a pause or
+        seek): do not count the jump as jitter."""
+        self.transit = None
+
+    def extendedMax(self):
+        return self.cycles + self.maxSeq
+
+    def expected(self):
+        if self.baseSeq is None:
+            return 0
+        return self.extendedMax() - self.baseSeq + 1
+
+    def lost(self):
+        return max(0, self.expected() - self.received)
+
+    def interval(self):
+        """(fraction lost, throughput in bit/s) since the last call."""
+        now = self.clock()
+        expected, received, nbytes = self.expected(), self.received, self.bytes
+        expectedInterval = expected - self.expectedPrior
+        lostInterval = expectedInterval - (received - self.receivedPrior)
+        elapsed = now - self.lastInterval
+        throughput = (nbytes - self.bytesPrior) * 8 / elapsed if elapsed > 0 else 0.0
+        self.expectedPrior, self.receivedPrior, self.bytesPrior = expected, received, nbytes
+        self.lastInterval = now
+        if expectedInterval <= 0 or lostInterval <= 0:
+            return 0.0, throughput
+        return lostInterval / expectedInterval, throughput
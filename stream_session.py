@@ -0,0 +1,510 @@
+# stream_session.py
+import asyncio
+import re
+import socket
+import threading
+from random import getrandbits
+
+import rtcp
+from RtpPacket import RtpPacket
+from cache_manager import CacheManager
+from hd_handler import HDHandler
+from jitter_buffer import JitterBuffer
+from playout_scheduler import PlayoutScheduler
+from rtp_receiver import RtpReceiver
+from rtp_stats import ReceptionStats
+
+MIN_LATENCY = 0.1  # seconds buffered before playback, on a clean link
+MAX_LATENCY = 2.0  # ... and on the worst one
+RTCP_INTERVAL = 1.0  # receiver report period (seconds)
+FEC_GROUP = 10  # ask for one HD parity packet per 10 fragments (0 = no FEC)
+NACK_RETRIES = 2  # retransmission requests per incomplete HD frame (0 = none)
+REPAIR_INTERVAL = 0.1  # check for HD frames that stopped receiving chunks (seconds)
+SEEK_WINDOW = 32  # frames after a seek target accepted before the PLAY reply arrives
+
+
+class StreamSession:
+    """
+    GUI-free streaming client: RTSP control, RTP receive, SD/HD frame
+    reassembly, the playout buffer (cache + jitter buffer + presentation
+    clock) and RTCP feedback (receiver reports, NACKs).
+
+    Frames come out either through the onFrame(frameNum, jpeg) callback,
+    called on the receive thread as each frame completes, or through the
+    frames() async iterator at their playout deadlines. With onFrame the
+    playout cache is off unless buffer=True, so a callback-only viewer
+    holds no frames and is never throttled by a full cache. Sessions can share
+    one RtpReceiver, so many simulated viewers need only one receive
+    thread. Client.py is the Tk view over this class.
+    """
+
+    # RTSP states
+    INIT = 0
+    READY = 1
+    PLAYING = 2
+
+    # RTSP commands
+    SETUP = "SETUP"
+    PLAY = "PLAY"
+    PAUSE = "PAUSE"
+    TEARDOWN = "TEARDOWN"
+
+    def __init__(self, serveraddr, serverport, rtpport, filename, hd=False, receiver=None,
+                 onFrame=None, onWarning=None, verbose=True, buffer=None):
+        # network info
+        self.serverAddr = serveraddr
+        self.serverPort = int(serverport)
+        self.rtpPort = int(rtpport)
+        self.rtpPort2 = self.rtpPort + 2
+        self.fileName = filename
+
+        # RTSP parameters
+        self.rtspSeq = 0
+        self.sessionId = 0
+        self.state = self.INIT
+        self.requestSent = -1
+        self.pendingRequests = {}  # CSeq -> command awaiting its reply
+        self.rtspLock = threading.Lock()  # requests come from the caller and RTP threads
+
+        self.isPaused = False
+        self.maxCacheSize = 2000  # frames (increased for buffering)
+        self.maxCacheBytes = 256 * 1024 * 1024  # HD frames are large: cap bytes too
+
+        # playback state
+        self.frameNbr = 0  # last frame presented
+        self.totalFrames = 0
+        self.latestReceivedFrame = 0
+        self.bufferWarmed = False
+        self.closed = False
+        # seeking: packets are only taken from frame seekFrame on, and once
+        # the PLAY reply is in, from RTP sequence number seekSeq on
+        self.seekFrame = None
+        self.seekSeq = None
+        self.flushPending = False  # receive thread still has to drop its partial frames
+
+        # modules
+        self.hdMode = hd
+        self.hd = HDHandler(nack_retries=NACK_RETRIES)
+        self.receiver = receiver  # RtpReceiver, shared or started on first PLAY
+        self.ownReceiver = receiver is None
+        self.rtcpTimer = None
+        self.repairTimer = None
+        self.jitter = JitterBuffer(min_latency=MIN_LATENCY, max_latency=MAX_LATENCY)
+        self.rxStats = ReceptionStats()
+        self.ssrc = getrandbits(32)  # our SSRC as the reporter in RTCP
+        self.rtcpPort = None  # server's receiver report port, from SETUP
+        self.framesCompleted = 0  # frames delivered this session (seeks included), for RTCP
+        self.framesDropped = 0  # invalid SD frames (HD drops are counted by HDHandler)
+        self.rtpPacket = RtpPacket()  # reused: decode() only takes views
+        self.expectedFrame = 1
+        self.frameBuffer = bytearray()  # SD frame being received
+        self.rtpSockets = []
+        self.rtcpSocket = None
+        self.cache = CacheManager(max_size=self.maxCacheSize, max_bytes=self.maxCacheBytes)
+        # presentation clock; the rate is replaced by the server's Fps header
+        self.playout = PlayoutScheduler(fps=25)
+
+        # hooks
+        self.onFrame = onFrame
+        # keep frames for frames() / a player; callback-only consumers do not
+        self.buffer = onFrame is None if buffer is None else buffer
+        self.onWarning = onWarning or (lambda title, message: print(f"[{title}] {message}"))
+        self.verbose = verbose
+
+    def log(self, *args):
+        if self.verbose:
+            print(*args)
+
+    def get_state_text(self):
+        if self.state == self.INIT:
+            return "INIT"
+        if self.state == self.READY:
+            return "READY"
+        if self.state == self.PLAYING:
+            return "PLAYING"
+        return "UNKNOWN"
+
+    # ============================================================
+    # CONTROL
+    # ============================================================
+
+    def setup(self):
+        if self.state == self.INIT:
+            self.sendRtspRequest(self.SETUP)
+
+    def play(self, start=None):
+        """Resume local playout and/or ask the server to stream (from frame
+        `start` if given); True when a PLAY request was sent."""
+        if self.isPaused:
+            self.isPaused = False
+            self.playout.reset()  # the clock does not run while paused
+        if self.state != self.READY and (start is None or self.state != self.PLAYING):
+            return False
+        # start the RTP receiver (one thread for all RTP sockets)
+        if self.rtcpTimer is None:
+            if self.receiver is None:
+                self.receiver = RtpReceiver()
+            for sock in self.rtpSockets:
+                self.receiver.register(sock, self.handleRtpPacket)
+            self.rtcpTimer = self.receiver.every(RTCP_INTERVAL, self.sendReceiverReport)
+            self.repairTimer = self.receiver.every(REPAIR_INTERVAL, self.repairSettled)
+            if self.ownReceiver:
+                self.receiver.start()
+        self.sendRtspRequest(self.PLAY, start)
+        return True
+
+    def seek(self, frameNum):
+        """Jump to frameNum without a new SETUP: flush the playout buffer and
+        ask the server to stream from there; True when PLAY was sent."""
+        if self.state == self.INIT or not self.totalFrames:
+            return False
+        frameNum = max(1, min(frameNum, self.totalFrames))
+        self.seekSeq = None
+        self.seekFrame = frameNum
+        self.flushPending = True
+        self.cache.clear()
+        self.playout.reset()
+        self.bufferWarmed = False
+        self.latestReceivedFrame = self.frameNbr = frameNum - 1
+        self.isPaused = False
+        return self.play(start=frameNum)
+
+    def pause(self):
+        # Only pause locally, let RTP threads continue buffering until limit
+        self.isPaused = True
+
+    def teardown(self):
+        if self.state != self.INIT:
+            self.sendRtspRequest(self.TEARDOWN)
+        self.close()
+
+    def close(self):
+        """Stop receiving and release the sockets."""
+        self.closed = True
+        if self.receiver is not None:
+            if self.rtcpTimer is not None:
+                self.receiver.cancel(self.rtcpTimer)
+                self.receiver.cancel(self.repairTimer)
+            if self.ownReceiver:
+                self.receiver.stop()
+            else:
+                for sock in self.rtpSockets:
+                    self.receiver.unregister(sock)
+        for sock in self.rtpSockets:
+            sock.close()
+        if self.rtcpSocket is not None:
+            self.rtcpSocket.close()
+        self.rtspSocket.close()
+
+    # ============================================================
+    # RTSP CONNECTION
+    # ============================================================
+
+    def connectToServer(self):
+        """Open the RTSP connection; raises OSError when the server is unreachable."""
+        self.rtspSocket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.rtspSocket.connect((self.serverAddr, self.serverPort))
+
+    def sendRtspRequest(self, code, start=None):
+        self.log(f"[RTSP] Sending {code}")
+
+        with self.rtspLock:
+            self.rtspSeq += 1
+            request = ""
+
+            if code == self.SETUP and self.state == self.INIT:
+                request = (
+                    f"SETUP {self.fileName} RTSP/1.0\n"
+                    f"CSeq: {self.rtspSeq}\n"
+                    f"Transport: RTP/UDP; client_port= {self.rtpPort}\n"
+                    f"Prefer: {'HD' if self.hdMode else 'SD'}\n"
+                    f"Fec: {FEC_GROUP}"
+                )
+                self.requestSent = self.SETUP
+                threading.Thread(target=self.recvRtspReply, daemon=True).start()
+
+            elif code in (self.PLAY, self.PAUSE, self.TEARDOWN):
+                request = (
+                    f"{code} {self.fileName} RTSP/1.0\n"
+                    f"CSeq: {self.rtspSeq}\n"
+                    f"Session: {self.sessionId}"
+                )
+                if code == self.PLAY and start is not None:
+                    # normal play time of the frame; the server rounds to the frame
+                    request += f"\nRange: npt={(start - 1) * self.playout.interval:.3f}-"
+                self.requestSent = code
+
+            self.pendingRequests[self.rtspSeq] = code
+            request += "\n\n"  # blank line ends the request
+            self.rtspSocket.send(request.encode())
+        self.log("[RTSP Request Sent]\n", request)
+
+    def recvRtspReply(self):
+        while True:
+            try:
+                reply = self.rtspSocket.recv(1024)
+                if reply:
+                    # one read may carry several replies
+                    for part in re.split(r"(?=RTSP/1\.0 )", reply.decode()):
+                        if part.strip():
+                            self.parseRtspReply(part)
+                if self.requestSent == self.TEARDOWN or not reply:
+                    self.rtspSocket.close()
+                    break
+            except:
+                break
+
+    def parseRtspReply(self, data):
+        lines = data.split("\n")
+        if len(lines) < 3:
+            return
+
+        status = int(lines[0].split(" ")[1])
+        seq = int(lines[1].split(" ")[1])
+        session = int(lines[2].split(" ")[1])
+
+        code = self.pendingRequests.pop(seq, None)
+        if code is None:
+            return
+
+        if self.sessionId == 0:
+            self.sessionId = session
+
+        if self.sessionId != session:
+            return
+
+        for line in lines[3:]:
+            if line.startswith("Frames"):
+                self.totalFrames = int(line.split(" ")[1])
+                self.cache.lastFrame = self.totalFrames
+            elif line.startswith("Fps"):
+                self.playout.setFps(float(line.split(" ")[1]))
+                self.hd.grace = self.playout.interval  # settle time before FEC / NACK
+            elif line.startswith("Rtcp-Port"):
+                self.rtcpPort = int(line.split(" ")[1])
+            elif line.startswith("Fec"):
+                self.hd.fec_group = int(line.split(" ")[1])  # what the server will send
+            elif line.startswith("RTP-Info") and self.seekFrame is not None:
+                # first packet of the new position: everything before it is stale
+                self.seekSeq = int(line.split("seq=")[1].split(";")[0])
+
+        if status == 200:
+            if code == self.SETUP:
+                self.openRtpPort()
+                self.state = self.READY
+                self.log("[RTSP] SETUP OK")
+
+            elif code == self.PLAY:
+                self.state = self.PLAYING
+                if self.seekFrame is not None and self.seekSeq is None:
+                    self.seekFrame = None  # no seek happened (old server?)
+                self.rxStats.interval()  # report intervals start with the stream
+                self.rxStats.resync()
+                self.log("[RTSP] PLAY OK")
+
+            elif code == self.PAUSE:
+                self.state = self.READY
+                self.isPaused = True
+                self.log("[RTSP] PAUSE OK")
+
+            elif code == self.TEARDOWN:
+                self.state = self.INIT
+                self.log("[RTSP] TEARDOWN OK")
+        elif code == self.PLAY:
+            self.log(f"[RTSP] PLAY failed ({status})")
+            self.seekFrame = None
+
+    # ============================================================
+    # RTP / RTCP
+    # ============================================================
+
+    def openRtpPort(self):
+        self.rtpSockets = []
+        for port in (self.rtpPort, self.rtpPort2):
+            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1 << 20) # 1MB buffer
+            try:
+                sock.bind(('', port))
+                self.rtpSockets.append(sock)
+                self.log(f"[RTP] Bound to port {port}")
+            except OSError:
+                sock.close()
+                self.onWarning("RTP Bind Failed", f"Cannot bind port {port}")
+        # receiver reports go out from RTP port + 1, as RTCP usually does
+        self.rtcpSocket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        try:
+            self.rtcpSocket.bind(('', self.rtpPort + 1))
+        except OSError:
+            pass  # any source port works for sending
+
+    def handleRtpPacket(self, data):
+        """Handle one datagram on the RtpReceiver thread (data is a view into
+        the receiver's ring, so anything kept must be copied)."""
+        rtp = self.rtpPacket
+        rtp.decode(data)
+        self.rxStats.onPacket(rtp.seqNum(), len(data), rtp.ssrc(), rtp.timestamp())
+        frameNum = rtp.frameId()  # 32-bit frame ID; seqNum() counts packets
+        payload = rtp.getPayload()
+        marker = rtp.marker()
+
+        if self.seekFrame is not None:
+            if self.flushPending:
+                # partial frames and the jitter estimate belong to the old position
+                self.flushPending = False
+                self.hd.reset()
+                self.frameBuffer = bytearray()
+                self.expectedFrame = self.seekFrame
+                self.jitter.reset()
+            if self.seekSeq is None:
+                if not self.seekFrame <= frameNum < self.seekFrame + SEEK_WINDOW:
+                    return
+            elif (rtp.seqNum() - self.seekSeq) & 0xFFFF >= 0x8000:
+                return  # sent before the seek
+
+        if self.isPaused:
+            # Buffering logic: if paused, keep buffering up to the latency bound
+            limit = self.jitter.maxFrames(self.playout.fps)
+            if self.cache.size() >= limit:
+                if self.state == self.PLAYING and self.requestSent != self.PAUSE:
+                    self.log(f"[BUFFER] Cache reached {MAX_LATENCY}s ({self.cache.size()}/{limit}), sending PAUSE")
+                    self.sendRtspRequest(self.PAUSE)
+                return  # drop until playback resumes
+        # frame jump → reset buffer
+        if frameNum != self.expectedFrame:
+            self.frameBuffer = bytearray()
+            self.expectedFrame = frameNum
+
+        if not self.hdMode:
+            # SD mode: one full frame
+            if self.buffer and self.cache.full():
+                return  # skip if cache full
+            self.frameBuffer.extend(payload)
+            if marker == 1:
+                if self.hd.is_valid_jpeg(self.frameBuffer):
+                    self.latestReceivedFrame = frameNum
+                    self.jitter.onFrame(rtp.timestamp())
+                    self.pushFrame(frameNum, bytes(self.frameBuffer))
+                else:
+                    self.framesDropped += 1
+                self.frameBuffer = bytearray()
+                self.expectedFrame = frameNum + 1
+
+        else:
+            # HD mode
+            if self.buffer and self.cache.full():
+                return  # skip if cache full
+            frame = self.hd.handle_hd_payload(frameNum, payload, marker)
+            if frame:
+                self.latestReceivedFrame = frameNum
+                if not self.hd.repaired:  # a NACK round trip is not network jitter
+                    self.jitter.onFrame(rtp.timestamp(), self.hd.latency)
+                self.pushFrame(frameNum, frame)
+                self.expectedFrame = frameNum + 1
+            self.takeRepaired()
+
+    def takeRepaired(self):
+        # older frames repaired by FEC (late by design: not fed to the jitter estimate)
+        for repairedNum, repaired in self.hd.take_ready():
+            self.latestReceivedFrame = max(self.latestReceivedFrame, repairedNum)
+            self.pushFrame(repairedNum, repaired)
+        if self.hd.nacks:
+            self.sendNacks()
+
+    def repairSettled(self):
+        """Receiver timer: repair HD frames that no newer frame will trigger
+        (the last one before a pause or the end of the stream)."""
+        if self.hdMode and self.state == self.PLAYING and not (self.buffer and self.cache.full()):
+            self.hd.repair_settled()
+            self.takeRepaired()
+
+    def pushFrame(self, frameNum, frame):
+        if self.seekSeq is not None:
+            self.seekFrame = self.seekSeq = None  # new position is flowing
+        self.framesCompleted += 1
+        if self.onFrame is not None:
+            self.onFrame(frameNum, frame)
+        if self.buffer:
+            self.cache.push_frame(frameNum, frame)
+
+    def sendReceiverReport(self):
+        """Periodic RTCP receiver report (receive thread); the server keeps
+        it per session and picks the HD rendition from it."""
+        stats = self.rxStats
+        if (self.state != self.PLAYING or self.requestSent == self.TEARDOWN
+                or not self.rtcpPort or stats.ssrc is None):
+            return
+        fraction, throughput = stats.interval()
+        report = rtcp.buildReport(
+            self.ssrc, stats.ssrc, fraction, stats.lost(), stats.extendedMax(),
+            stats.jitter,
+            self.framesCompleted, self.framesDropped + self.hd.dropped + self.hd.evicted,
+            throughput)
+        try:
+            self.rtcpSocket.sendto(report, (self.serverAddr, self.rtcpPort))
+        except OSError as e:
+            self.log("[RTCP] Send failed:", e)
+
+    def sendNacks(self):
+        """Ask the server to resend HD fragments that FEC could not rebuild
+        (RTP receiver thread), unless playout has already passed the frame."""
+        playhead = self.cache.next or 0
+        for frameNum, missing in self.hd.take_nacks():
+            if frameNum < playhead or not self.rtcpPort:
+                continue
+            packet = rtcp.buildNack(self.ssrc, self.rxStats.ssrc, frameNum, playhead, missing)
+            try:
+                self.rtcpSocket.sendto(packet, (self.serverAddr, self.rtcpPort))
+            except OSError as e:
+                self.log("[RTCP] NACK failed:", e)
+
+    # ============================================================
+    # PLAYOUT
+    # ============================================================
+
+    def ended(self):
+        return bool(self.totalFrames) and self.latestReceivedFrame >= self.totalFrames
+
+    def buffering(self):
+        """True while the jitter buffer fills to its target depth, before
+        playback starts and after an underrun."""
+        if self.bufferWarmed:
+            return False
+        if self.cache.size() < self.jitter.targetFrames(self.playout.fps) and not self.ended():
+            return True
+        self.log(f"[BUFFER] Start after {self.cache.size()} frames, {self.jitter.stats()}")
+        self.bufferWarmed = True
+        self.playout.reset()
+        return False
+
+    def checkUnderrun(self, pending=0):
+        """Nothing buffered (nor `pending` in the caller's decoder) but the
+        stream goes on: rebuild the target depth before playing again."""
+        if self.cache.size() == 0 and pending == 0 and not self.ended():
+            self.bufferWarmed = False
+            return True
+        return False
+
+    async def frames(self):
+        """Frames in presentation order at their playout deadlines, as
+        (frameNum, jpeg); late frames are skipped when newer ones wait."""
+        while not self.closed:
+            if self.state != self.PLAYING or self.isPaused or self.buffering():
+                await asyncio.sleep(0.01)
+                continue
+            item = self.cache.pop_frame()
+            if item is None:
+                if self.ended():
+                    break
+                self.checkUnderrun()
+                await asyncio.sleep(min(0.005, self.playout.interval))
+                continue
+            frameNum, frame = item
+            if self.playout.isLate(frameNum) and self.cache.size() > 0:
+                self.playout.skip(frameNum)
+                continue
+            wait = self.playout.due(frameNum)
+            if wait > 0.001:
+                await asyncio.sleep(wait)
+            self.playout.markShown(frameNum)
+            self.frameNbr = frameNum
+            yield frameNum, frame
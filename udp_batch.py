@@ -0,0 +1,271 @@
+# udp_batch.py
+"""
+Batched UDP transmission for fragmented RTP frames.
+
+A packet is a tuple of buffers (RTP header, fragment prefix, payload) that is
+never concatenated in Python. BatchSender picks the cheapest path the
+platform offers:
+
+  gso       one sendmsg per destination, kernel splits it (Linux UDP_SEGMENT)
+  sendmsg   one scatter-gather syscall per packet
+  sendto    the original path: join the parts, one sendto per packet
+
+sendmmsg (one syscall for the whole batch, via ctypes) is only used when
+asked for: marshalling and copying into the staging slots make it slower
+than sendmsg in bench_udp.py.
+"""
+import ctypes
+import ctypes.util
+import errno
+import socket
+import struct
+import sys
+
+UDP_SEGMENT = getattr(socket, "UDP_SEGMENT", 103)  # linux/udp.h
+SOL_UDP = getattr(socket, "SOL_UDP", 17)
+GSO_MAX_SEGMENTS = 64
+GSO_MAX_BYTES = 65000  # a GSO super-packet must still fit in one UDP datagram
+
+MAX_BATCH = 64  # messages per sendmmsg call
+SLOT_SIZE = 2048  # staging bytes per message; bigger packets use sendmsg
+
+
+class _iovec(ctypes.Structure):
+    _fields_ = [("iov_base", ctypes.c_void_p), ("iov_len", ctypes.c_size_t)]
+
+
+class _msghdr(ctypes.Structure):
+    _fields_ = [("msg_name", ctypes.c_void_p),
+                ("msg_namelen", ctypes.c_uint32),
+                ("msg_iov", ctypes.POINTER(_iovec)),
+                ("msg_iovlen", ctypes.c_size_t),
+                ("msg_control", ctypes.c_void_p),
+                ("msg_controllen", ctypes.c_size_t),
+                ("msg_flags", ctypes.c_int)]
+
+
+class _mmsghdr(ctypes.Structure):
+    _fields_ = [("msg_hdr", _msghdr), ("msg_len", ctypes.c_uint)]
+
+
+class _sockaddr_in(ctypes.Structure):
+    _fields_ = [("sin_family", ctypes.c_ushort),
+                ("sin_port", ctypes.c_uint16),   # network byte order
+                ("sin_addr", ctypes.c_uint8 * 4),
+                ("sin_zero", ctypes.c_uint8 * 8)]
+
+
+def _load_sendmmsg():
+    if not sys.platform.startswith("linux"):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or None, use_errno=True)
+        fn = libc.sendmmsg
+    except (OSError, AttributeError):
+        return None
+    fn.argtypes = [ctypes.c_int, ctypes.POINTER(_mmsghdr), ctypes.c_uint, ctypes.c_int]
+    fn.restype = ctypes.c_int
+    return fn
+
+
+_sendmmsg = _load_sendmmsg()
+
+
+def _gso_supported(sock):
+    if not sys.platform.startswith("linux") or not hasattr(sock, "sendmsg"):
+        return False
+    try:
+        sock.setsockopt(SOL_UDP, UDP_SEGMENT, 0)  # probe only; 0 = off by default
+        return True
+    except OSError:
+        return False
+
+
+class BatchSender:
+    """
+    Send lists of (parts, address) packets over one UDP socket.
+    send() returns the packets that did not go out, in batch order (empty
+    when all did); on a non-blocking socket the caller is responsible for
+    them (EAGAIN stops the batch). GSO sends per destination, so they are
+    not always a tail of the batch.
+    """
+
+    MODES = ("gso", "sendmmsg", "sendmsg", "sendto")
+
+    def __init__(self, sock, mode=None):
+        self.sock = sock
+        self._setMode(mode or self._best_mode())
+
+    def _setMode(self, mode):
+        self.mode = mode
+        if mode == "sendmmsg":
+            # Preallocated message headers, each with one iovec over its own
+            # staging slot; only lengths and destinations change per batch.
+            self._msgs = (_mmsghdr * MAX_BATCH)()
+            self._iovs = (_iovec * MAX_BATCH)()
+            self._staging = bytearray(MAX_BATCH * SLOT_SIZE)
+            base = ctypes.addressof(ctypes.c_char.from_buffer(self._staging))
+            for i in range(MAX_BATCH):
+                self._iovs[i].iov_base = base + i * SLOT_SIZE
+                hdr = self._msgs[i].msg_hdr
+                hdr.msg_iov = ctypes.pointer(self._iovs[i])
+                hdr.msg_iovlen = 1
+            self._addrs = {}  # (host, port) -> _sockaddr_in
+
+    def _best_mode(self):
+        if self.sock.family != socket.AF_INET:
+            return "sendmsg" if hasattr(self.sock, "sendmsg") else "sendto"
+        if _gso_supported(self.sock):
+            return "gso"
+        if hasattr(self.sock, "sendmsg"):
+            return "sendmsg"
+        return "sendto"
+
+    def send(self, packets):
+        if self.mode == "gso":
+            return self._send_gso(packets)
+        if self.mode == "sendmmsg":
+            return packets[self._send_mmsg(packets):]
+        if self.mode == "sendmsg":
+            return packets[self._send_each(packets, self._sendmsg_one):]
+        return packets[self._send_each(packets, self._sendto_one):]
+
+    # ==========================
+    # FALLBACK PATHS
+    # ==========================
+    def _sendto_one(self, parts, address):
+        self.sock.sendto(b"".join(parts), address)
+
+    def _sendmsg_one(self, parts, address):
+        self.sock.sendmsg(parts, (), 0, address)
+
+    def _send_each(self, packets, sendOne):
+        sent = 0
+        for parts, address in packets:
+            try:
+                sendOne(parts, address)
+            except BlockingIOError:
+                break
+            sent += 1
+        return sent
+
+    # ==========================
+    # SENDMMSG (ctypes)
+    # ==========================
+    def _sockaddr(self, address):
+        sa = self._addrs.get(address)
+        if sa is None:
+            sa = _sockaddr_in()
+            sa.sin_family = socket.AF_INET
+            sa.sin_port = socket.htons(address[1])
+            sa.sin_addr[:] = socket.inet_aton(address[0])
+            self._addrs[address] = sa
+        return sa
+
+    def _stage(self, slot, parts, address):
+        """Copy one packet into its staging slot; False if it cannot be batched."""
+        size = sum(len(p) for p in parts)
+        if size > SLOT_SIZE:
+            return False
+        try:
+            sa = self._sockaddr(address)
+        except OSError:  # not a numeric IPv4 address
+            return False
+        offset = slot * SLOT_SIZE
+        for part in parts:
+            n = len(part)
+            self._staging[offset:offset + n] = part
+            offset += n
+        self._iovs[slot].iov_len = size
+        hdr = self._msgs[slot].msg_hdr
+        hdr.msg_name = ctypes.addressof(sa)
+        hdr.msg_namelen = ctypes.sizeof(sa)
+        return True
+
+    def _send_mmsg(self, packets):
+        sent = 0
+        total = len(packets)
+        while sent < total:
+            count = 0
+            while sent + count < total and count < MAX_BATCH:
+                parts, address = packets[sent + count]
+                if not self._stage(count, parts, address):
+                    break
+                count += 1
+
+            if count == 0:
+                # oversized or non-IPv4 packet: send it on its own
+                parts, address = packets[sent]
+                try:
+                    self._sendmsg_one(parts, address)
+                except BlockingIOError:
+                    return sent
+                sent += 1
+                continue
+
+            done = _sendmmsg(self.sock.fileno(), self._msgs, count, 0)
+            if done < 0:
+                err = ctypes.get_errno()
+                if err in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    return sent
+                raise OSError(err, "sendmmsg: " + errno.errorcode.get(err, str(err)))
+            sent += done
+            if done < count:
+                return sent
+        return sent
+
+    # ==========================
+    # UDP GSO
+    # ==========================
+    def _send_gso(self, packets):
+        """Group packets by destination; each run of equal-size segments
+        (only the last may be shorter) goes out in one sendmsg.
+
+        The group holding the batch's final packet is sent last, so a frame's
+        marker packet still arrives after its other fragments."""
+        groups = {}
+        last = {}
+        for i, (parts, address) in enumerate(packets):
+            groups.setdefault(address, []).append(i)
+            last[address] = i
+        groups = sorted(groups.items(), key=lambda item: last[item[0]])
+
+        for g, (address, indices) in enumerate(groups):
+            group = [packets[k][0] for k in indices]
+            i = 0
+            while i < len(group):
+                segSize = sum(len(p) for p in group[i])
+                buffers = list(group[i])
+                j = i + 1
+                while (j < len(group) and j - i < GSO_MAX_SEGMENTS
+                       and (j - i + 1) * segSize <= GSO_MAX_BYTES):
+                    size = sum(len(p) for p in group[j])
+                    if size > segSize:
+                        break
+                    buffers.extend(group[j])
+                    j += 1
+                    if size < segSize:
+                        break  # a short segment must be the last one
+                try:
+                    if j - i == 1:
+                        self.sock.sendmsg(buffers, (), 0, address)
+                    else:
+                        cmsg = [(SOL_UDP, UDP_SEGMENT, struct.pack("H", segSize))]
+                        self.sock.sendmsg(buffers, cmsg, 0, address)
+                except BlockingIOError:
+                    return self._unsent(packets, indices[i:], groups[g + 1:])
+                except OSError as exc:
+                    # e.g. EIO when the route cannot offload: downgrade for good
+                    print("UDP GSO unavailable, falling back:", exc)
+                    self._setMode("sendmsg")
+                    return self.send(self._unsent(packets, indices[i:], groups[g + 1:]))
+                i = j
+        return []
+
+    @staticmethod
+    def _unsent(packets, indices, groups):
+        """Packets of the failed group from `indices` on, plus every later group."""
+        indices = list(indices)
+        for _, other in groups:
+            indices.extend(other)
+        return [packets[k] for k in sorted(indices)]